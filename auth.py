@@ -1,4 +1,4 @@
-from functions import json_file
+from mappings import mappings
 
 
 class GeneralEntity:
@@ -8,8 +8,9 @@ class GeneralEntity:
 
     def __init__(self):
 
-        # Dictionary Objects
-        self._bundle = json_file("dicts/bundles.json")
-        self._field = json_file("dicts/fields.json")
-        self._query = json_file("dicts/sparql_queries.json")
-        self._language = json_file("dicts/lang.json")
+        # Dictionary Objects (shared, read-only snapshot of the mapping registry)
+        current = mappings.current()
+        self._bundle = current.bundles
+        self._field = current.fields
+        self._query = current.queries
+        self._language = current.languages
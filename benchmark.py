@@ -0,0 +1,228 @@
+# Libraries
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from itertools import islice
+from pathlib import Path
+
+from entity_builder import DocumentEntity
+from field_registry import BUILDERS
+from offline_harness import FakeApi, LocalSparqlClient, fixture_document
+from uri_cache import UriCache
+
+"""
+Throughput benchmarks of staging, lookups and uploads, run against the offline harness.
+
+For every collection size, a synthetic collection (see `offline_harness.fixture_document`)
+is staged and then uploaded, measuring documents per second, the time spent in each
+builder method, SPARQL queries per document, the cache hit ratio and (in a separate pass)
+the peak memory of the upload. Results can be saved as a baseline and later runs compared against it:
+
+    python benchmark.py --sizes 100 10000 --save-baseline
+    python benchmark.py --sizes 100 10000 --compare
+
+The import time of the builders is checked separately, in fresh interpreters; it fails
+when `import entity_builder` exceeds the budget or loads pandas or pymongo:
+
+    python benchmark.py --imports --import-budget 0.5
+
+Numbers depend on the machine; compare runs made on the same one.
+"""
+
+# Metrics compared with the baseline: name -> whether higher is better
+_COMPARED = {
+    'staging_docs_per_s': True,
+    'upload_docs_per_s': True,
+    'queries_per_doc': False,
+    'cache_hit_ratio': True,
+    'peak_memory_mb': False
+}
+
+# Modules only loaded on the code paths that need them (CSV results, MongoDB)
+_HEAVY_MODULES = ('pandas', 'pymongo', 'numpy', 'requests')
+
+
+class CountingUriCache(UriCache):
+    """
+    Entity URI cache counting the hits and misses of its lookups.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        found = super().__contains__(key)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found
+
+
+class TimedDocumentEntity(DocumentEntity):
+    """
+    Document entity accumulating the time spent in each builder method.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings = defaultdict(float)
+        for builder in BUILDERS:
+            setattr(self, builder, self._timed(builder, getattr(self, builder)))
+
+    def _timed(self, name, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.timings[name] += time.perf_counter() - start
+        return timed
+
+
+def synthetic_collection(size: int):
+    return (fixture_document(index) for index in range(1, size + 1))
+
+
+def bench_staging(size: int) -> dict:
+    client, cache = LocalSparqlClient(), CountingUriCache()
+    uploader = TimedDocumentEntity(FakeApi(), cache=cache, client=client)
+    start = time.perf_counter()
+    for doc in synthetic_collection(size):
+        uploader.document(doc)
+        uploader.staging()
+    elapsed = time.perf_counter() - start
+    return {
+        'staging_docs_per_s': size / elapsed,
+        'queries_per_doc': client.query_count / size,
+        'cache_hit_ratio': cache.hits / max(cache.hits + cache.misses, 1),
+        'builder_ms_per_doc': {name: 1000 * seconds / size for name, seconds in sorted(uploader.timings.items())}
+    }
+
+
+def bench_upload(size: int, batch_size: int = 200, trace_memory: bool = False) -> dict:
+    # The fake API does not keep the payloads, so that the memory of the import itself is measured
+    client, api = LocalSparqlClient(), FakeApi(keep_payloads=False)
+    uploader = DocumentEntity(api, cache=UriCache(), client=client)
+    documents = synthetic_collection(size)
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    # Batches with prefetched lookups, as in BulkImport
+    while batch := list(islice(documents, batch_size)):
+        uploader.prefetch(batch)
+        for doc in batch:
+            uploader.document(doc)
+            uploader.upload()
+            if trace_memory:
+                # The record of the calls grows with the documents, unlike the import itself
+                api.calls.clear()
+    elapsed = time.perf_counter() - start
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {'peak_memory_mb': peak / 2 ** 20}
+    return {
+        'upload_docs_per_s': size / elapsed,
+        'upload_queries_per_doc': client.query_count / size,
+        'saves': len(api.calls)
+    }
+
+
+def run(sizes: list[int], memory: bool = True) -> dict:
+    results = {}
+    for size in sizes:
+        print(f"Benchmarking {size} documents ...", file=sys.stderr)
+        results[str(size)] = {**bench_staging(size), **bench_upload(size)}
+        # Separate pass, tracing allocations slows the upload down considerably
+        if memory:
+            results[str(size)].update(bench_upload(size, trace_memory=True))
+    return results
+
+
+def bench_import(module: str = "entity_builder", runs: int = 5) -> dict:
+    """
+    Import time of a module in a fresh interpreter (best of `runs`) and the heavy modules it loads.
+    """
+    code = (f"import json, sys, time\nstart = time.perf_counter()\nimport {module}\n"
+            f"print(json.dumps([time.perf_counter() - start, [m for m in {_HEAVY_MODULES!r} if m in sys.modules]]))")
+    timings, heavy = [], []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=Path(__file__).resolve().parent).stdout
+        seconds, heavy = json.loads(output.splitlines()[-1])
+        timings.append(seconds)
+    return {'module': module, 'import_seconds': min(timings), 'heavy_modules': heavy}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'machine': platform.platform(), 'commit': commit}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Print the metrics next to the baseline; returns the regressions beyond the tolerance.
+    """
+    regressions = []
+    for size, metrics in results.items():
+        if size not in baseline:
+            continue
+        print(f"\n{size} documents")
+        for name, higher_is_better in _COMPARED.items():
+            old, new = baseline[size].get(name), metrics.get(name)
+            if not old or new is None:
+                continue
+            change = new / old - 1
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print(f"  {name:<22} {old:>12.3f} -> {new:>12.3f}  {change:+.1%}{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{size}: {name}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of staging, lookups and uploads.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 10_000, 100_000])
+    parser.add_argument('--baseline', default="benchmarks/baseline.json")
+    parser.add_argument('--save-baseline', action='store_true', help="store the results as the baseline")
+    parser.add_argument('--compare', action='store_true', help="compare the results with the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative change counted as regression")
+    parser.add_argument('--output', help="write the results (JSON) to this file")
+    parser.add_argument('--no-memory', action='store_true', help="skip the peak memory pass")
+    parser.add_argument('--imports', action='store_true', help="only check the import time of the builders")
+    parser.add_argument('--import-budget', type=float, default=0.5, help="seconds allowed for importing them")
+    args = parser.parse_args()
+
+    if args.imports:
+        result = bench_import()
+        print(json.dumps(result, indent=2))
+        if result['import_seconds'] > args.import_budget:
+            print(f"\nImporting {result['module']} exceeds the budget of {args.import_budget}s")
+        if result['heavy_modules']:
+            print(f"\nImporting {result['module']} loads {', '.join(result['heavy_modules'])}")
+        sys.exit(1 if result['import_seconds'] > args.import_budget or result['heavy_modules'] else 0)
+
+    report = {'environment': environment(), 'results': run(args.sizes, memory=not args.no_memory)}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.baseline).write_text(json.dumps(report, indent=2))
+    if args.compare:
+        regressions = compare(report['results'], json.loads(Path(args.baseline).read_text())['results'],
+                              args.tolerance)
+        if regressions:
+            print(f"\nRegressions: {', '.join(regressions)}")
+            sys.exit(1)
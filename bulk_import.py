@@ -0,0 +1,261 @@
+# Libraries
+import json
+import os
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterable
+
+from entity_builder import DocumentEntity
+from entity_updater import DocumentUpdate
+from tracing import tracer
+
+"""
+Checkpointed bulk import of research data items.
+
+Every saved research data item is recorded in a local journal (one JSON line per item,
+flushed to disk immediately), so that an interrupted import can be started again with the
+same documents and skips everything already committed.
+"""
+
+
+class ImportJournal:
+    """
+    Append-only journal of the research data items saved by an import, by DRE identifier.
+    """
+
+    def __init__(self, path: str = "cache/import_journal.jsonl"):
+        self._path = Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._records = {}
+        self.watermark = None
+
+        if self._path.is_file():
+            with self._path.open() as file_obj:
+                for line in file_obj:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Line cut off by an interruption, the item was not committed
+                        continue
+                    if 'watermark' in record:
+                        self.watermark = record['watermark']
+                        continue
+                    # Later records of an item complete earlier ones
+                    self._records.setdefault(record['dre_id'], {}).update(record)
+
+        # Terminate a line cut off by an interruption before appending
+        cut_off = False
+        if self._path.is_file() and self._path.stat().st_size:
+            with self._path.open('rb') as file_obj:
+                file_obj.seek(-1, os.SEEK_END)
+                cut_off = file_obj.read(1) != b"\n"
+        self._file = self._path.open('a')
+        if cut_off:
+            self._file.write("\n")
+
+    def _append(self, record: dict):
+        self._file.write(json.dumps(record, default=str) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, dre_id: str, **values):
+        """
+        Durably record (or complete the record of) an item.
+        """
+        record = {'dre_id': dre_id, **values}
+        self._append(record)
+        self._records.setdefault(dre_id, {}).update(record)
+
+    def set_watermark(self, watermark):
+        """
+        Record the highest watermark value (ObjectId or timestamp) of a complete run.
+        """
+        self._append({'watermark': watermark})
+        self.watermark = json.loads(json.dumps(watermark, default=str))
+
+    def get(self, dre_id: str) -> dict | None:
+        return self._records.get(dre_id)
+
+    def close(self):
+        self._file.close()
+
+    def __contains__(self, dre_id: str):
+        return dre_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+
+class BulkImport:
+    """
+    Imports documents with a `DocumentEntity`, skipping the items recorded in the journal.
+
+    Items already in WissKI (checked per batch, with batched queries on the DRE identifiers)
+    are handled according to `on_existing`:
+    - 'skip': not uploaded again, only recorded in the journal (default)
+    - 'update': passed to the given `DocumentUpdate`
+    - 'upload': no check, uploaded regardless
+
+    With `incremental=True`, journaled items whose source content changed since they were
+    recorded are passed to the `DocumentUpdate` as well; unchanged items are skipped. The
+    journal holds a content hash per field written (all fields on upload, the updater's on
+    update) and only the fields of the `DocumentUpdate` are compared. Items without known
+    hashes (e.g. found in WissKI) count as changed.
+    Documents without a DRE identifier are reported as failed.
+    """
+
+    def __init__(self, uploader: DocumentEntity, journal: ImportJournal | str = "cache/import_journal.jsonl",
+                 batch_size: int = 200, on_existing: str = 'skip', updater: DocumentUpdate | None = None,
+                 incremental: bool = False, watermark_field: str | None = None):
+        if on_existing not in ('skip', 'update', 'upload'):
+            raise ValueError(f"Unknown on_existing mode: {on_existing}")
+        if (on_existing == 'update' or incremental) and updater is None:
+            raise ValueError("An updater is required to update existing items")
+        self._uploader = uploader
+        # Journals opened from a path are closed with the importer
+        self._owns_journal = not isinstance(journal, ImportJournal)
+        self._journal = ImportJournal(journal) if self._owns_journal else journal
+        self._batch_size = batch_size
+        self._on_existing = on_existing
+        self._updater = updater
+        self._incremental = incremental
+        self._watermark_field = watermark_field
+
+    def watermark_filter(self) -> dict:
+        """
+        Mongo filter selecting the documents after the watermark of the last complete run.
+
+        Only meaningful with a `watermark_field` that changes with each edit of a document
+        (e.g. `updatedAt`); use it as `filter_str` to avoid reading unchanged documents.
+        """
+        watermark = self._journal.watermark
+        if self._watermark_field is None or watermark is None:
+            return {}
+        if self._watermark_field == '_id':
+            from bson import ObjectId
+            watermark = ObjectId(watermark)
+        else:
+            watermark = datetime.fromisoformat(watermark)
+        return {self._watermark_field: {'$gt': watermark}}
+
+    def _record_hashes(self, dre_id: str, hashes: dict):
+        # Only the fields written are recorded as synced, next to the hashes of earlier writes
+        record = self._journal.get(dre_id) or {}
+        self._journal.record(dre_id, hashes={**record.get('hashes', {}), **hashes})
+
+    def _changed(self, doc: dict) -> bool:
+        record = self._journal.get(doc.get('dre_id'))
+        hashes = self._updater.field_hashes(doc)
+        if 'hashes' not in record and 'hash' in record:
+            # Hashed over another key set by an earlier version, the hashes of now are the baseline
+            self._record_hashes(doc.get('dre_id'), hashes)
+            return False
+        recorded = record.get('hashes', {})
+        return any(recorded.get(field_name) != value for field_name, value in hashes.items())
+
+    def _update(self, docs: list[dict], summary: dict, key: str):
+        for doc in docs:
+            try:
+                update_summary = self._updater.run(documents=[doc])
+            except Exception as e:
+                summary['failed'].append((doc.get('dre_id'), str(e)))
+                continue
+            if update_summary['failed']:
+                failed_methods = ', '.join(method for _, method in update_summary['failed'])
+                summary['failed'].append((doc.get('dre_id'), f"Not updated: {failed_methods}"))
+                continue
+            self._record_hashes(doc.get('dre_id'), self._updater.field_hashes(doc))
+            summary[key] += 1
+
+    def _import_batch(self, batch: list[dict], summary: dict):
+        # Items are journaled by DRE identifier, documents without one cannot be imported
+        for doc in batch:
+            if not doc.get('dre_id'):
+                summary['failed'].append((None, f"Missing dre_id (_id {doc.get('_id')})"))
+        batch = [doc for doc in batch if doc.get('dre_id')]
+
+        pending = [doc for doc in batch if doc.get('dre_id') not in self._journal]
+        journaled = [doc for doc in batch if doc.get('dre_id') in self._journal]
+
+        # Journaled items are only touched again when their source changed
+        changed = [doc for doc in journaled if self._changed(doc)] if self._incremental else []
+        summary['skipped'] += len(journaled) - len(changed)
+        if changed:
+            self._update(changed, summary, 'updated')
+
+        # Items created by an earlier (unjournaled) run or by other means
+        if pending and self._on_existing != 'upload':
+            existing = self._uploader.existing_items([doc.get('dre_id') for doc in pending])
+            existing_docs = [doc for doc in pending if doc.get('dre_id') in existing]
+            pending = [doc for doc in pending if doc.get('dre_id') not in existing]
+            for doc in existing_docs:
+                self._journal.record(doc.get('dre_id'), uri=existing[doc.get('dre_id')])
+            if self._on_existing == 'update':
+                self._update(existing_docs, summary, 'existing')
+            else:
+                summary['existing'] += len(existing_docs)
+        if not pending:
+            return
+
+        try:
+            self._uploader.prefetch(pending)
+        except Exception as e:
+            # A value failing the batched queries fails them for the whole batch; the documents
+            # are looked up one by one instead, so that only the offending one fails
+            print(f"Prefetch failed, looking up the batch per document: {e}")
+        unresolved = []
+        for doc in pending:
+            try:
+                self._uploader.document(doc)
+                entity = self._uploader.upload()
+            except Exception as e:
+                summary['failed'].append((doc.get('dre_id'), str(e)))
+                continue
+            uri = getattr(entity, 'uri', None)
+            self._journal.record(doc.get('dre_id'), uri=uri, hashes=self._uploader.field_hashes(doc))
+            summary['saved'] += 1
+            if uri is None:
+                unresolved.append(doc.get('dre_id'))
+
+        # URIs the API did not return are looked up by DRE identifier
+        if unresolved:
+            for dre_id, uri in self._uploader.existing_items(unresolved).items():
+                self._journal.record(dre_id, uri=uri)
+
+    def run(self, documents: Iterable[dict]) -> dict:
+        """
+        Upload all documents not yet in the journal.
+
+        Documents are processed in batches: their lookups are prefetched together and the
+        URIs of the saved items are resolved with one query per batch. Failing documents are
+        reported and retried by the next run.
+        """
+        summary = {'saved': 0, 'updated': 0, 'skipped': 0, 'existing': 0, 'failed': []}
+        watermark = None
+        documents = iter(documents)
+        while batch := list(islice(documents, self._batch_size)):
+            if self._watermark_field is not None:
+                values = [doc.get(self._watermark_field) for doc in batch if doc.get(self._watermark_field)]
+                watermark = max([watermark, *values] if watermark is not None else values, default=None)
+
+            with tracer.span('batch', documents=len(batch)):
+                self._import_batch(batch, summary)
+
+        # The watermark only advances when nothing has to be retried
+        if watermark is not None and not summary['failed']:
+            self._journal.set_watermark(watermark)
+        return summary
+
+    def close(self):
+        """
+        Close the journal, if it was opened by the importer.
+        """
+        if self._owns_journal:
+            self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
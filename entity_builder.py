@@ -1,14 +1,22 @@
+import asyncio
+import functools
+import hashlib
+import json
 from datetime import datetime
 from typing import NamedTuple, MutableMapping
 from urllib.parse import urlparse
 import re
 
-import pandas as pd
 from wisski.api import Api, Entity
 
 from auth import GeneralEntity
 from exception_functions import FieldFunctions
-from functions import entity_list_generate, entity_uri, try_func
+from field_registry import FIELDS, FieldEvaluator, source_keys
+from functions import cache_key, entity_list_generate, entity_uri, entity_uri_batch, is_null, try_func
+from sparql_client import SparqlClient
+from text_normaliser import TextNormaliser, free_text, note_text
+from tracing import tracer
+from uri_cache import UriCache
 
 
 class RegionFormatHolder(NamedTuple):
@@ -40,11 +48,20 @@ class DocumentEntity(GeneralEntity):
     Class for creating the Research Data Item entity
     """
 
+    # Genre authorities
+    _genre_authorities = {
+        'marc': 'MARC Genre Term List',
+        'loc': 'Library of Congress Genre',
+        'aat': 'Art & architecture thesaurus online',
+        'tgm2': 'Thesaurus For Graphic Materials',
+        'none': 'No Authority/Uncatalogued Genre'
+    }
+
     def __init__(
         self,
         api: Api,
-        return_value: bool = False,
-        cache: MutableMapping[str, str] = {},
+        cache: MutableMapping[str, str] | None = None,
+        client: SparqlClient | None = None,
     ):
         # Super class
         super().__init__()
@@ -56,12 +73,12 @@ class DocumentEntity(GeneralEntity):
         self._document = None
     
         # Entity URI cache
-        self._cache = cache if cache is not None else {}
+        self._cache = cache if cache is not None else UriCache()
 
-        # Function to return Entity values (Bool)
-        self._return_value = return_value
+        # SPARQL client (the shared default client unless one is injected)
+        self._client = client
 
-        self._field_functions = FieldFunctions(self._api)
+        self._field_functions = FieldFunctions(self._api, cache=self._cache, client=self._client)
 
         # Core dictionary for Research Data Items
         self._research_data_item = {}
@@ -70,6 +87,142 @@ class DocumentEntity(GeneralEntity):
     def document(self, bson_document: dict):
         setattr(self, "_document", bson_document)
 
+    # Mongo projection of the keys read for the given fields
+    @classmethod
+    def projection(cls, fields: str | list[str] | None = None) -> dict:
+        """
+        Minimal Mongo projection for the given fields (default: all of staging), named as in
+        `field_registry.FIELDS` (e.g. 'subject', 'createDate').
+
+        Pass it to `mongodata_fetch`/`mongodata_stream` to only transfer the keys the
+        builders read. The DRE identifier is always included.
+        """
+        if isinstance(fields, str):
+            fields = [fields]
+        keys = {'dre_id'} | source_keys(fields)
+        # Mongo rejects a projection holding both a key and one of its sub-keys
+        keys = {k for k in keys if not any(k.startswith(f"{other}.") for other in keys)}
+        return {key: 1 for key in sorted(keys)}
+
+    # Fingerprint of the source values the builders read from a document
+    def content_hash(self, document: dict | None = None, fields: list[str] | None = None) -> str:
+        """
+        Stable hash of the source values of a document (default: the current document).
+
+        Only the keys of `projection` (for the given fields, default: all) are hashed, so that
+        changes to keys no builder reads (e.g. Mongo bookkeeping fields) do not mark a
+        document as changed.
+        """
+        document = document if document is not None else self._document
+        return self._hash_keys(document, self.projection(fields))
+
+    def field_hashes(self, document: dict | None = None, fields: list[str] | None = None) -> dict:
+        """
+        Short content hash of each of the given fields (default: all), by field name.
+        """
+        document = document if document is not None else self._document
+        return {field_name: self._hash_keys(document, self._field_keys(field_name))[:16]
+                for field_name in (fields if fields is not None else FIELDS)}
+
+    @classmethod
+    @functools.cache
+    def _field_keys(cls, field_name: str) -> tuple[str, ...]:
+        return tuple(cls.projection(field_name))
+
+    @staticmethod
+    def _hash_keys(document: dict, keys) -> str:
+        values = {}
+        for key in keys:
+            value = document
+            for part in key.split('.'):
+                value = value.get(part) if isinstance(value, dict) else None
+            values[key] = value
+        canonical = json.dumps(values, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    # Lookups (query key, search value) the builder methods will issue for a document
+    def _lookups(self, document: dict):
+        yield 'typeofresource', document.get('typeOfResource')
+        if isinstance(document.get('project'), dict):
+            yield 'projectid', document.get('project').get('id')
+        for value in document.get('collection') or []:
+            yield 'collection', value
+        yield 'identifier', "DRE Identifier"
+        for iden in document.get('identifier') or []:
+            yield 'identifier', iden.get('identifier_type')
+        for l in document.get('language') or []:
+            yield 'language', try_func(l.lower(), lambda x: self._language.get(x))
+        for loc_obj in (document.get('location') or {}).get('origin') or []:
+            l1, l2, l3 = self._origin_levels(loc_obj)
+            if not is_null(l1) and l1 != "":
+                yield 'country', l1
+            if not is_null(l2) and l2 != "":
+                yield 'region', RegionFormatHolder(level_0=l2, level_1=l1)
+            if not is_null(l3) and l3 != "":
+                yield 'subregion', RegionFormatHolder(level_0=l3, level_1=l2)
+        for value in (document.get('location') or {}).get('current') or []:
+            yield 'place', value
+        for value in (document.get('accessCondition') or {}).get('rights') or []:
+            yield 'license', value
+        for value in document.get('targetAudience') or []:
+            yield 'audience', value
+        yield 'role', "Sponsor"
+        for funder in document.get('sponsor') or []:
+            yield 'sponsor', funder
+        for name in document.get('name') or []:
+            yield name.get('name').get('qualifier'), name.get('name').get('label')
+            yield 'role', name.get('role')
+        for authority, terms in (document.get('genre') or {}).items():
+            yield 'authority', self._genre_authorities.get(authority)
+            # Genre terms are looked up by the URI of their authority, once it is known
+            authority_uri = self._cache.get(
+                cache_key(self._genre_authorities.get(authority), self._query.get('authority'))
+            )
+            if authority_uri:
+                for term in terms:
+                    yield 'genre', GenreFormatHolder(term=term, authority=authority_uri.split("data/")[1])
+        for sub in document.get('subject') or []:
+            yield 'subjectURI', sub.get('uri')
+            yield 'subjectLabel', sub.get('origLabel')
+            yield 'authorityURL', sub.get('authority')
+        for value in document.get('tags') or []:
+            yield 'tags', value
+        _repo_id = re.search(r"(?<=\w{3}\-)(.*)(?=\-\w{4})", document.get("dre_id") or "")
+        if _repo_id and _repo_id[0] != "99":
+            yield 'repository', f"R{_repo_id[0]}"
+
+    # Resolve all lookups of one or many documents with batched queries
+    def prefetch(self, documents: list[dict] | None = None):
+        """
+        Fill the entity URI cache for the given documents (default: the current document) and
+        normalise their free text.
+
+        Lookups are grouped by query and resolved with one VALUES query per query key,
+        repeated until lookups depending on earlier results (genre terms) are resolved too.
+        The queries are traced under a 'prefetch' span tagged with the DRE identifiers.
+        """
+        documents = documents if documents is not None else [self._document]
+        # Shared by the documents of the batch, so traced beside their document spans
+        with tracer.span('prefetch', dre_ids=[str(doc.get('dre_id')) for doc in documents]):
+            # Free text of the batch is normalised in one pass
+            note_text.prepare(doc.get('note') for doc in documents)
+            free_text.prepare(value for doc in documents for value in (doc.get('abstract'), doc.get('tableOfContents')))
+            resolved = set()
+            while True:
+                pending = {}
+                for doc in documents:
+                    for query_key, search_value in self._lookups(doc):
+                        if not isinstance(search_value, (str, tuple)) or self._query.get(query_key) is None:
+                            continue
+                        if (query_key, search_value) in resolved:
+                            continue
+                        pending.setdefault(query_key, []).append(search_value)
+                if not pending:
+                    break
+                for query_key, search_values in pending.items():
+                    entity_uri_batch(search_values, self._query.get(query_key), cache=self._cache, client=self._client)
+                    resolved.update((query_key, search_value) for search_value in search_values)
+
 
     # Type of Resource (Mandatory Field)
     def resource_type(self):
@@ -77,13 +230,10 @@ class DocumentEntity(GeneralEntity):
             entity_uri(
               self._document.get('typeOfResource'),
               self._query.get('typeofresource'),
-              cache=self._cache
+              cache=self._cache, client=self._client
             )
         ]
-        if self._return_value:
-            return _type_of_resource
-        else:
-            self._research_data_item[self._field.get('f_research_data_item_type_res')] = _type_of_resource
+        return _type_of_resource
 
 
     # Project
@@ -93,13 +243,10 @@ class DocumentEntity(GeneralEntity):
                 entity_uri(
                   self._document.get('project')['id'],
                   self._query.get('projectid'),
-                  cache=self._cache
+                  cache=self._cache, client=self._client
                 )
             ]
-            if self._return_value:
-                return _project_entity
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_project')] = _project_entity
+            return _project_entity
         except KeyError:
             pass
 
@@ -110,16 +257,13 @@ class DocumentEntity(GeneralEntity):
             # Collection fields
             collection_fields = {
                 self._field['f_res_item_collection']: entity_list_generate(self._document.get('collection'),
-                                                                           query_name=self._query.get('collection'))}
+                                                                           query_name=self._query.get('collection'),
+                                                                           cache=self._cache, client=self._client)}
             # Collection entity
             collection_entity = Entity(
                 api=self._api, fields=collection_fields,
                 bundle_id=self._bundle.get('g_res_item_collection'))
-            if self._return_value:
-                return [collection_entity]
-            else:
-                # Initialising collection field
-                self._research_data_item[self._bundle.get("g_res_item_collection")] = [collection_entity]
+            return [collection_entity]
 
 
     # Entity list of identifiers
@@ -128,7 +272,7 @@ class DocumentEntity(GeneralEntity):
         _dreidfields_ = {
             self._field["f_research_data_item_id_name"]: [self._document.get("dre_id")],
             self._field["f_research_data_item_id_type"]: [
-                entity_uri("DRE Identifier", self._query.get("identifier"), cache=self._cache)
+                entity_uri("DRE Identifier", self._query.get("identifier"), cache=self._cache, client=self._client)
             ],
         }
         _dreidentity_ = Entity(api=self._api, fields=_dreidfields_,
@@ -142,7 +286,7 @@ class DocumentEntity(GeneralEntity):
                 self._field["f_research_data_item_id_name"]: [iden.get("identifier")],
                 self._field["f_research_data_item_id_type"]: [
                     entity_uri(
-                        iden.get("identifier_type"), self._query.get("identifier"), cache=self._cache
+                        iden.get("identifier_type"), self._query.get("identifier"), cache=self._cache, client=self._client
                     )
                 ],
             }
@@ -151,10 +295,7 @@ class DocumentEntity(GeneralEntity):
                                        bundle_id=self._bundle['g_research_data_item_identifier'])
             entity_list.append(identifier_entity)
 
-        if self._return_value:
-            return entity_list
-        else:
-            self._research_data_item[self._bundle.get('g_research_data_item_identifier')] = entity_list
+        return entity_list
 
     
     # Language
@@ -164,26 +305,31 @@ class DocumentEntity(GeneralEntity):
             lang_list = entity_list_generate(
                 document_languages,
                 self._query.get('language'),
-                exception_function=self._field_functions.exception('language'),
-                with_exception=True
+                exception_function=self._field_functions.exception('language', self._query.get('language')),
+                with_exception=True,
+                cache=self._cache, client=self._client
             )
-            if self._return_value:
-                return lang_list
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_language')] = lang_list
+            return lang_list
 
     
     # Citation
     def citation(self):
         if self._document.get('citation'):
             citation_value = self._document.get('citation')
-            if self._return_value:
-                return citation_value
-            else:
-                self._research_data_item[
-                    self._field.get('f_research_data_item_citation')
-                ] = self._document.get('citation')
+            return citation_value
+
 
+    # Country, region and subregion of an origin location
+    @staticmethod
+    def _origin_levels(loc_obj: dict) -> tuple:
+        levels = []
+        for level in ("l1", "l2", "l3"):
+            value = loc_obj.get(level)
+            # Extract string from list if needed
+            if isinstance(value, list):
+                value = value[0] if value else ""
+            levels.append(value)
+        return tuple(levels)
 
     # Geographic Location
     def originlocation(self):
@@ -193,36 +339,27 @@ class DocumentEntity(GeneralEntity):
         _subregion_values = []
 
         for loc_obj in _origin:
-            # Extract string from list if needed
-            l1 = loc_obj.get("l1")
-            l2 = loc_obj.get("l2")
-            l3 = loc_obj.get("l3")
-            if isinstance(l1, list):
-                l1 = l1[0] if l1 else ""
-            if isinstance(l2, list):
-                l2 = l2[0] if l2 else ""
-            if isinstance(l3, list):
-                l3 = l3[0] if l3 else ""
+            l1, l2, l3 = self._origin_levels(loc_obj)
 
             # Country
-            if not pd.isna(l1) and l1 != "":
+            if not is_null(l1) and l1 != "":
                 _country_values.append(
                     entity_uri(
                         search_value=l1,
                         query_string=self._query.get("country"),
-                        cache=self._cache
+                        cache=self._cache, client=self._client
                     )
                 )
 
             # Region (level 2)
-            if not pd.isna(l2) and l2 != "":
+            if not is_null(l2) and l2 != "":
                 _region_uri = entity_uri(
                     search_value=RegionFormatHolder(
                         level_0=l2, level_1=l1
                     ),
                     query_string=self._query.get("region"),
                     conditional=True,
-                    cache=self._cache
+                    cache=self._cache, client=self._client
                 )
                 _region_values.append(_region_uri)
 
@@ -230,39 +367,34 @@ class DocumentEntity(GeneralEntity):
             """
             In case of an exception we assume, that the region values is already given.
             """
-            if not pd.isna(l3) and l3 != "":
+            if not is_null(l3) and l3 != "":
                 _subregion = entity_uri(
                     search_value=RegionFormatHolder(
                         level_0=l3, level_1=l2
                     ),
                     query_string=self._query.get("subregion"),
                     conditional=True,
-                    cache=self._cache
+                    cache=self._cache, client=self._client
                 )
                 if _subregion and urlparse(_subregion).scheme != '':
                     _subregion_values.append(_subregion)
                 elif not _subregion:
                     _subregion_values.append(
-                        self._field_functions.exception('subregion')(entity_value=l3,
-                                                                     qualifier_value=_region_uri,
-                                                                     with_qualifier=True)
+                        self._field_functions.exception('subregion', self._query.get('subregion'))(
+                            entity_value=l3,
+                            qualifier_value=_region_uri,
+                            with_qualifier=True,
+                            search_value=RegionFormatHolder(level_0=l3, level_1=l2)
+                        )
                     )
-        if self._return_value:
-            _ol_return_dicts = {}
-            if _country_values:
-                _ol_return_dicts['l1'] = _country_values
-            if _region_values:
-                _ol_return_dicts['l2'] = _region_values
-            if _subregion_values:
-                _ol_return_dicts['l3'] = _subregion_values
-            return _ol_return_dicts
-        else:
-            if _country_values:
-                self._research_data_item[self._field.get('f_research_data_creat_country')] = _country_values
-            if _region_values:
-                self._research_data_item[self._field.get('f_research_data_item_creat_regio')] = _region_values
-            if _subregion_values:
-                self._research_data_item[self._field.get('f_research_data_item_creat_subre')] = _subregion_values
+        _ol_return_dicts = {}
+        if _country_values:
+            _ol_return_dicts['l1'] = _country_values
+        if _region_values:
+            _ol_return_dicts['l2'] = _region_values
+        if _subregion_values:
+            _ol_return_dicts['l3'] = _subregion_values
+        return _ol_return_dicts
 
 
     # Current Location
@@ -271,24 +403,17 @@ class DocumentEntity(GeneralEntity):
             _current_location_value = entity_list_generate(
                 value_list=self._document.get('location').get('current'),
                 query_name=self._query.get('place'),
-                exception_function=self._field_functions.exception('place'),
-                with_exception=True
+                exception_function=self._field_functions.exception('place', self._query.get('place')),
+                with_exception=True,
+                cache=self._cache, client=self._client
             )
-            if self._return_value:
-                return _current_location_value
-            else:
-                self._research_data_item[
-                    self._field.get('f_research_data_item_located_at')
-                ] = _current_location_value
+            return _current_location_value
 
 
     # URL
     def url_link(self):
         if self._document.get('url'):
-            if self._return_value:
-                return self._document.get('url')
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_url')] = self._document.get('url')
+            return self._document.get('url')
 
 
     # Copyright
@@ -297,11 +422,9 @@ class DocumentEntity(GeneralEntity):
             _copyright_values = entity_list_generate(
                 self._document.get('accessCondition')['rights'],
                 self._query.get('license'),
+                cache=self._cache, client=self._client
             )
-            if self._return_value:
-                return _copyright_values
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_copyright')] = _copyright_values
+            return _copyright_values
 
 
     # Target Audience
@@ -310,77 +433,55 @@ class DocumentEntity(GeneralEntity):
             _target_audience_values = entity_list_generate(
                 value_list=self._document.get('targetAudience'),
                 query_name=self._query.get('audience'),
-                exception_function=self._field_functions.exception('audience'),
-                with_exception=True
+                exception_function=self._field_functions.exception('audience', self._query.get('audience')),
+                with_exception=True,
+                cache=self._cache, client=self._client
             )
-            if self._return_value:
-                return _target_audience_values
-            else:
-                self._research_data_item[self._field.get('f_research_data_target_audience')] = _target_audience_values
+            return _target_audience_values
+
 
+    # Free text (normalised), None when empty
+    def _free_text(self, key: str, normaliser: TextNormaliser):
+        value = self._document.get(key)
+        if not value or is_null(value):
+            return None
+        if not isinstance(value, str):
+            return [value]
+        value = normaliser(value)
+        return [value] if value else None
 
     # Abstract
     def abstract(self):
-        if self._document.get('abstract') and pd.isna(self._document.get('abstract')) is False:
-            if self._return_value:
-                return [self._document.get('abstract')]
-            else:
-                self._research_data_item[self._field.get('f_research_data_abstract')] = [self._document.get('abstract')]
+        return self._free_text('abstract', free_text)
 
 
     # Table of Content
     def tabel_of_content(self):
-        if self._document.get('tableOfContents') and pd.isna(self._document.get('tableOfContents')) is False:
-            if self._return_value:
-                return [self._document.get('tableOfContents')]
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_toc')] = [self._document.get('tableOfContents')]
+        return self._free_text('tableOfContents', free_text)
 
 
     # Note(s)
     def note(self):
-        if self._document.get('note') and pd.isna(self._document.get('note')) is False:
-            note_value = self._document.get('note')
-            
-            # Split into lines while preserving intentional line breaks
-            lines = note_value.splitlines()
-            
-            # Clean each line separately
-            cleaned_lines = []
-            for line in lines:
-                # Remove any non-printable characters while keeping extended Latin
-                cleaned_line = re.sub(r'[^\x20-\x7E\u00A0-\u00FF]', '', line)
-                # Normalize whitespace within each line
-                cleaned_line = ' '.join(cleaned_line.strip().split())
-                # Additional safety check
-                cleaned_line = ''.join(char for char in cleaned_line if ord(char) >= 32)
-                cleaned_lines.append(cleaned_line)
-            
-            # Join lines back together with newlines
-            cleaned_note = '\n'.join(line for line in cleaned_lines if line)
-            
-            if self._return_value:
-                return [cleaned_note]
-            else:
-                self._research_data_item[self._field.get('f_research_data_note')] = [cleaned_note]
+        # Notes keep only printable Latin-1 characters
+        return self._free_text('note', note_text)
 
 
     # Associated Person (Mandatory Field)
     def role(self):
         name_entity_list = []
         sponsor_role = entity_uri(
-            search_value="Sponsor", query_string=self._query.get("role"), cache=self._cache
+            search_value="Sponsor", query_string=self._query.get("role"), cache=self._cache, client=self._client
         )
 
         # Sponsor (Associated Group) (mandatory field)
         # Fetches sponsor uri/creates Entity object in case of exception
         for funder in self._document.get("sponsor"):
             sponsor_value = entity_uri(
-                search_value=funder, query_string=self._query.get("sponsor"), cache=self._cache
+                search_value=funder, query_string=self._query.get("sponsor"), cache=self._cache, client=self._client
             )
             
             if sponsor_value is None:
-                sponsor_value = self._field_functions.exception('sponsor')(funder)
+                sponsor_value = self._field_functions.exception('sponsor', self._query.get('sponsor'))(funder)
             name_entity_list.append(
                 Entity(api=self._api,
                        fields={
@@ -404,24 +505,21 @@ class DocumentEntity(GeneralEntity):
                             entity_uri(
                                 search_value=name.get("name").get("label"),
                                 query_string=self._query.get(qualifier),
-                                cache=self._cache
+                                cache=self._cache, client=self._client
                             )
                         ],
                         self._field.get("f_research_data_item_apers_role"): [
                             entity_uri(
                                 search_value=name.get("role"),
                                 query_string=self._query.get("role"),
-                                cache=self._cache
+                                cache=self._cache, client=self._client
                             )
                         ],
                     },
                     bundle_id=self._bundle.get("g_research_data_item_ass_person"),
                 )
             )
-        if self._return_value:
-            return name_entity_list
-        else:
-            self._research_data_item[self._bundle.get('g_research_data_item_ass_person')] = name_entity_list
+        return name_entity_list
 
 
     # Title Information
@@ -439,12 +537,7 @@ class DocumentEntity(GeneralEntity):
                            }, bundle_id=self._bundle.get('g_research_data_item_title'))
                 )
         
-        if self._return_value:
-            return {'main': _main_title, 'alt': title_entity_list}
-        else:
-            self._research_data_item[self._field.get('f_research_data_item_title_main')] = _main_title
-            if title_entity_list:
-                self._research_data_item[self._bundle.get('g_research_data_item_title')] = title_entity_list
+        return {'main': _main_title, 'alt': title_entity_list}
 
 
     # Dates
@@ -481,14 +574,8 @@ class DocumentEntity(GeneralEntity):
                 except (TypeError, ValueError) as e:
                     pass
 
-        if self._return_value:
-            return {'created': created_date_value,
-                    'alt': additional_dates}
-        else:
-            if created_date_value:
-                self._research_data_item[self._field.get('f_research_data_item_create_date')] = created_date_value
-            if additional_dates:
-                self._research_data_item[self._bundle.get('g_research_data_item_date_add')] = additional_dates
+        return {'created': created_date_value,
+                'alt': additional_dates}
 
 
     # Technical Description
@@ -502,7 +589,7 @@ class DocumentEntity(GeneralEntity):
             ]
         }
         # Method
-        if not pd.isna(pd_dict.get('method')):
+        if not is_null(pd_dict.get('method')):
             resource_type_dict[self._field.get('f_reseach_data_item_res_t_method')] = [pd_dict.get('method')]
         # Description
         if pd_dict.get('desc'):
@@ -517,33 +604,35 @@ class DocumentEntity(GeneralEntity):
             bundle_id=self._bundle.get('g_reseach_data_item_res_type')
         )]
 
-        if self._return_value:
-            return pd_entity
-        else:
-            self._research_data_item[self._bundle.get('g_reseach_data_item_res_type')] = pd_entity
+        return pd_entity
 
-        # Technical Property
-        if pd_dict.get('tech'):
-            self._research_data_item[self._field.get('f_reseach_data_item_tech_prop')] = pd_dict.get('tech')
 
+    # Technical Property
+    def technical_property(self):
+        if self._document.get('physicalDescription').get('tech'):
+            return self._document.get('physicalDescription').get('tech')
 
-    # Genre
-    def genre(self):
-        genre_dict = {
-            'marc': 'MARC Genre Term List',
-            'loc': 'Library of Congress Genre',
-            'aat': 'Art & architecture thesaurus online',
-            'tgm2': 'Thesaurus For Graphic Materials',
-            'none': 'No Authority/Uncatalogued Genre'
+
+    # Genre authorities (authority key -> URI)
+    def genre_authority(self):
+        return {
+            authority: entity_uri(
+                search_value=self._genre_authorities.get(authority),
+                query_string=self._query.get("authority"),
+                cache=self._cache, client=self._client
+            )
+            for authority in self._document.get('genre').keys()
         }
+
+
+    # Genre
+    def genre(self, genre_authority: dict | None = None):
+        if genre_authority is None:
+            genre_authority = self.genre_authority()
         genre_entities = []
         genre_terms = self._document.get('genre')
         for authority in genre_terms.keys():
-            authority_uri = entity_uri(
-                search_value=genre_dict.get(authority),
-                query_string=self._query.get("authority"),
-                cache=self._cache
-            )
+            authority_uri = genre_authority.get(authority)
             for term in genre_terms.get(authority):
                 term_uri = entity_uri(
                     search_value=GenreFormatHolder(
@@ -551,22 +640,20 @@ class DocumentEntity(GeneralEntity):
                     ),
                     query_string=self._query.get("genre"),
                     conditional=True,
-                    cache=self._cache
+                    cache=self._cache, client=self._client
                 )
         
                 if term_uri is None:
-                    genre_entities.append(self._field_functions.exception('genre')(
+                    genre_entities.append(self._field_functions.exception('genre', self._query.get('genre'))(
                         entity_value=term,
                         qualifier_value=authority_uri,
-                        with_qualifier=True
+                        with_qualifier=True,
+                        search_value=GenreFormatHolder(term=term, authority=authority_uri.split("data/")[1])
                     ))
                 elif urlparse(term_uri).scheme != '':
                     genre_entities.append(term_uri)
 
-        if self._return_value:
-            return genre_entities
-        else:
-            self._research_data_item[self._field.get('f_research_data_item_auth_tag')] = genre_entities
+        return genre_entities
 
 
     # Subject(s)
@@ -575,9 +662,9 @@ class DocumentEntity(GeneralEntity):
             subject_list = []
             for sub in self._document.get("subject"):
 
-                by_uri = entity_uri(sub.get("uri"), self._query.get("subjectURI"), cache=self._cache)
+                by_uri = entity_uri(sub.get("uri"), self._query.get("subjectURI"), cache=self._cache, client=self._client)
                 by_label = entity_uri(
-                    sub.get("origLabel"), self._query.get("subjectLabel"), cache=self._cache
+                    sub.get("origLabel"), self._query.get("subjectLabel"), cache=self._cache, client=self._client
                 )
 
                 if by_uri:
@@ -586,19 +673,19 @@ class DocumentEntity(GeneralEntity):
                     subject_list.append(by_label)
                 else:
                     subject_fields = {}
-                    if not pd.isna(sub.get('uri')):
+                    if not is_null(sub.get('uri')):
                         subject_fields[self._field.get('f_subject_url')] = [sub.get('uri')]
-                    if not pd.isna(sub.get('authority')):
+                    if not is_null(sub.get('authority')):
                         # Authority must be in system already
                         authority_uri = entity_uri(
                             sub.get("authority"),
                             query_string=self._query.get("authorityURL"),
-                            cache=self._cache
+                            cache=self._cache, client=self._client
                         )
                         subject_fields[self._field.get("f_subject_authority")] = [
                             authority_uri
                         ]
-                    if pd.isna(sub.get("authLabel")):
+                    if is_null(sub.get("authLabel")):
                         subject_fields[self._field.get("f_subject_tag")] = [
                             sub.get("origLabel")
                         ]
@@ -610,10 +697,7 @@ class DocumentEntity(GeneralEntity):
                         Entity(api=self._api, fields=subject_fields,
                                bundle_id=self._bundle.get('g_subject'))
                     )
-            if self._return_value:
-                return subject_list
-            else:
-                self._research_data_item[self._field.get('f_research_data_item_subject')] = subject_list
+            return subject_list
 
 
     # Tag(s)
@@ -622,25 +706,18 @@ class DocumentEntity(GeneralEntity):
             _tag_values = entity_list_generate(
                 value_list=self._document.get('tags'),
                 query_name=self._query.get('tags'),
-                exception_function=self._field_functions.exception('tags'),
-                with_exception=True
+                exception_function=self._field_functions.exception('tags', self._query.get('tags')),
+                with_exception=True,
+                cache=self._cache, client=self._client
             )
-            if self._return_value:
-                return _tag_values
-            else:
-                self._research_data_item[self._field.get('f_reseach_data_item_tag')] = _tag_values
+            return _tag_values
 
 
     # Preview Image URL
     def preview_image(self):
         try:
             if self._document.get('previewImage'):
-                if self._return_value:
-                    return self._document.get('previewImage')
-                else:
-                    self._research_data_item[
-                        self._field.get('f_research_data_item_prv_img_url')
-                    ] = self._document.get('previewImage')
+                return self._document.get('previewImage')
         except KeyError:
             pass
 
@@ -650,49 +727,63 @@ class DocumentEntity(GeneralEntity):
             repo_value = [entity_uri(
                     search_value=f"R{_repo_id}",
                     query_string=self._query.get('repository'),
-                    cache=self._cache
+                    cache=self._cache, client=self._client
                 )]
         else:
             repo_value = []
-        if self._return_value:
-            return repo_value
-        else:
-            if repo_value:
-                self._research_data_item[
-                    self._field.get('f_res_item_data_repository')
-                ] = repo_value
+        return repo_value
 
     # Staged Values
     def staging(self):
-        self._research_data_item = {}
-        self.resource_type()
-        self.project()
-        self.collection()
-        self.identifier_entities()
-        self.language()
-        self.citation()
-        self.originlocation()
-        self.currentlocation()
-        self.url_link()
-        self.copyright()
-        self.target_audience()
-        self.abstract()
-        self.tabel_of_content()
-        self.note()
-        self.role()
-        self.titles()
-        self.dateinfo()
-        self.physicaldesc()
-        self.genre()
-        self.subject()
-        self.tags()
-        self.preview_image()
-        self.repository()
+        self._field_functions.discard()
+        self._research_data_item = FieldEvaluator(self).staged()
+        return self._research_data_item
+
+    # Staged Values (concurrent)
+    async def staging_async(self, concurrency: int = 8):
+        """
+        Asynchronous variant of `staging`, running the builder methods concurrently.
+
+        Each builder runs in a worker thread once its dependencies are done, at most
+        `concurrency` at a time. Returns the same fields as `staging`. One instance stages
+        one document at a time.
+        """
+        self._field_functions.discard()
+        evaluator = FieldEvaluator(self)
+        await evaluator.evaluate_async(concurrency=concurrency)
+        self._research_data_item = evaluator.staged()
         return self._research_data_item
 
     def upload(self):
-        self._api.save(Entity(
-            api=self._api,
-            fields=self.staging(),
-            bundle_id=self._bundle.get('g_research_data_item')
-        ))
+        with tracer.span('document', dre_id=self._document.get('dre_id')):
+            research_data_item = Entity(
+                api=self._api,
+                fields=self.staging(),
+                bundle_id=self._bundle.get('g_research_data_item')
+            )
+            with tracer.span('save'):
+                self._api.save(research_data_item)
+            # Newly created exception entities are known from now on
+            self._field_functions.commit()
+        return research_data_item
+
+    async def upload_async(self, concurrency: int = 8):
+        with tracer.span('document', dre_id=self._document.get('dre_id')):
+            research_data_item = Entity(
+                api=self._api,
+                fields=await self.staging_async(concurrency=concurrency),
+                bundle_id=self._bundle.get('g_research_data_item')
+            )
+            with tracer.span('save'):
+                await asyncio.to_thread(self._api.save, research_data_item)
+            # Newly created exception entities are known from now on
+            self._field_functions.commit()
+        return research_data_item
+
+    # Research data items already in WissKI
+    def existing_items(self, dre_ids: list[str]) -> dict:
+        """
+        URIs of the research data items with the given DRE identifiers, resolved with batched
+        queries. Identifiers without an item are left out. The cache is bypassed on purpose.
+        """
+        return entity_uri_batch(dre_ids, self._query.get('dreID'), cache={}, client=self._client)
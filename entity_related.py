@@ -3,6 +3,7 @@ import jmespath as jp
 from auth import GeneralEntity
 from wisski.api import Api, Entity
 from functions import entity_list_generate, entity_uri
+from sparql_client import SparqlClient
 
 """
 This script is intended for updating the related items sections of each research data items specified
@@ -11,9 +12,13 @@ for a given project. The class UpdateRelations will take in a Mongo collection l
 
 class UpdateRelation(GeneralEntity):
 
-    def __init__(self, api: Api, data: list[dict]):
+    # Mongo projection of the keys read from each document
+    projection = {'dre_id': 1, 'relatedItems': 1}
+
+    def __init__(self, api: Api, data: list[dict], client: SparqlClient | None = None):
         super().__init__()
         self._api = api
+        self._client = client
         self._data = data
         self._doc = []
         self._succeed_list = []
@@ -30,7 +35,7 @@ class UpdateRelation(GeneralEntity):
     def get_entities(self, query: str | None, doc: dict):
         entities = jp.search(query, doc)
         if entities:
-            return entity_list_generate(value_list=entities, query_name=self._query.get('ldID'))
+            return entity_list_generate(value_list=entities, query_name=self._query.get('ldID'), client=self._client)
 
     def set_entities(self, document):
         setattr(self, "_succeed_list", self.get_entities("items.rel_succ", document))
@@ -59,7 +64,9 @@ class UpdateRelation(GeneralEntity):
             _edit_entity = self._api.get_entity(
                 entity_uri(
                     doc.get('id'),
-                    query_string=self._query.get('dreID')
+                    query_string=self._query.get('dreID'),
+                    # Existence lookup, items may just have been created: the cache is bypassed
+                    cache={}, client=self._client
                 )
             )
             _collection_entity = Entity(
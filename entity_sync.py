@@ -1,8 +1,5 @@
-# Data Wrangling
-import pandas as pd
-
 # Data Parsing
-import jmespath as jm
+import unicodedata
 
 # Local Libraries
 from auth import *
@@ -10,6 +7,12 @@ from functions import *
 
 # WissKI
 from wisski.api import Api, Entity
+from sparql_client import SparqlClient
+
+
+# Label form used to match entities between MongoDB and WissKI
+def normalise_label(label: str) -> str:
+    return " ".join(unicodedata.normalize('NFKC', label).casefold().split())
 
 
 # Class for Associated Entities Synchronisation
@@ -23,13 +26,18 @@ class EntitySync(GeneralEntity):
     - Update function
     """
 
-    def __init__(self, api: Api, sync_field: str):
+    def __init__(self, api: Api, sync_field: str, client: SparqlClient | None = None,
+                 records: list[dict] | None = None):
         # API-client
         self._api = api
 
+        # SPARQL client (the shared default client unless one is injected)
+        self._client = client
+
         # Field name initialisation
         self._sync_field_name = sync_field
-        self._collection = mongodata_fetch(db_name='dev', collection_name=self._sync_field_name)
+        # Mongo records of the sync field (read from MongoDB on first use unless given)
+        self._mongo_records = records
         self._single_fields = ['institutions', 'groups']
         self._double_fields = ['persons', 'collections']
 
@@ -64,41 +72,57 @@ class EntitySync(GeneralEntity):
             }
         }
 
+    # Mongo records of the sync field, read on first use
+    @property
+    def _collection(self):
+        if self._mongo_records is None:
+            self._mongo_records = list(mongodata_stream(db_name='dev', collection_name=self._sync_field_name))
+        return self._mongo_records
+
+    # WissKI Entities (URI, label), streamed page by page
+    def wisski_entities(self, page_size: int = LIST_PAGE_SIZE):
+        return entity_list_stream(
+            self._query.get(self._bundle_dict.get(self._sync_field_name)['query']),
+            page_size=page_size,
+            client=self._client
+        )
+
     # WissKI Entity List
     def wisski_list(self):
-        # Gets the appropriate query from bundle_dict based on sync_field_name
-        # Returns a list of all entities currently in WissKI
-        return list(entity_uri(
-            search_value="",
-            query_string=self._query.get(self._bundle_dict.get(self._sync_field_name)['query']),
-            return_format='csv',
-            value_input=False
-        ).iloc[:, 0])
+        # Returns a list of the labels of all entities currently in WissKI
+        return [label for _, label in self.wisski_entities()]
+
+    # Entities of both systems, matched on normalised labels
+    def reconcile(self) -> dict:
+        """
+        Compare the Mongo records with the WissKI entities of the sync field.
+
+        Returns the Mongo records missing in WissKI (one per label), the WissKI entities
+        (URI, label) without Mongo record, and the labels held by more than one record or
+        entity on either side.
+        """
+        # Normalised label -> Mongo records, and -> WissKI entities
+        mongo_index = {}
+        for record in self._collection:
+            if record.get('name'):
+                mongo_index.setdefault(normalise_label(record.get('name')), []).append(record)
+        wisski_index = {}
+        for uri, label in self.wisski_entities():
+            wisski_index.setdefault(normalise_label(label), []).append((uri, label))
+
+        return {
+            'missing': [records[0] for key, records in mongo_index.items() if key not in wisski_index],
+            'extra': [entities[0] for key, entities in wisski_index.items() if key not in mongo_index],
+            'ambiguous': {
+                key: {'mongo': mongo_index.get(key, []), 'wisski': wisski_index.get(key, [])}
+                for key in mongo_index.keys() | wisski_index.keys()
+                if len(mongo_index.get(key, [])) > 1 or len(wisski_index.get(key, [])) > 1
+            }
+        }
 
     def missing_entities(self):
-        # Gets lists from both systems
-        wisskiList = self.wisski_list()   # Entities in WissKI
-        mongo_response = self._collection   # Entities in MongoDB
-        mongoList = jm.search("[].name", mongo_response)   # Extracts names from MongoDB data
-        
-        # Finds entities that exist in MongoDB but not in WissKI
-        missing = []
-        for entity in mongoList:
-            if entity not in wisskiList:
-                # Instead of using f-string, use a more robust approach, which handles the escaping properly
-                results = []
-                for item in mongo_response:
-                    if item.get('name') == entity:
-                        results.append(item)
-                
-                # Only append if a match was found
-                if results:
-                    missing.append(results[0])
-                else:
-                    print(f"Warning: Could not find '{entity}' in MongoDB response")
-            else:
-                pass
-        return missing
+        # Entities that exist in MongoDB but not in WissKI
+        return self.reconcile()['missing']
 
     def staged(self):
         entity_values_list = []   # Stores the field values
@@ -118,7 +142,8 @@ class EntitySync(GeneralEntity):
                     if entity.get(field_dict.get('alt_field_label')):
                         entity_value[self._field.get(field_dict.get('alt_field'))] = entity_list_generate(
                             value_list=entity.get(field_dict.get('alt_field_label')),
-                            query_name=self._query.get('institution')
+                            query_name=self._query.get('institution'),
+                            client=self._client
                         )
                 else:
                     # Handle other double fields (like collections)
@@ -153,123 +178,104 @@ class EntitySync(GeneralEntity):
     done once institution list is up-to-date)
     """
 
-    def affiliations_update(self, single_person: str | None = None):
+    # Current affiliations (institution URIs) of person entities, by person URI
+    def current_affiliations(self, person_uris: list[str], batch_size: int = BATCH_SIZE) -> dict:
+        affiliations = {uri: set() for uri in person_uris}
+        for start in range(0, len(person_uris), batch_size):
+            chunk = person_uris[start:start + batch_size]
+            query_response = (self._client or default_client()).query(
+                self._query.get('personaffiliations').format(search_value=' '.join(f"<{uri}>" for uri in chunk))
+            )
+            for row in result_rows(query_response):
+                affiliations[row.id].add(row.affiliation)
+        return affiliations
+
+    def affiliations_update(self, single_person: str | None = None, dry_run: bool = False):
         """
         Updates person entities with new affiliations from MongoDB.
 
+        Person and institution URIs and the current affiliations are resolved with batched
+        queries; only persons whose set of affiliations differs are saved.
+
         Args:
         single_person (str, optional): Name of specific person to update
+        dry_run (bool, optional): Report the changes without saving them
         Returns:
         str: A summary of the update process including successes and warnings
         """
-        # Get persons from MongoDB, filtered by name if provided
-        if single_person:
-            mongo_persons = [p for p in self._collection if p['name'] == single_person]
-        else:
-            mongo_persons = self._collection
-        
+        # Get persons from MongoDB (one record per name), filtered by name if provided
+        mongo_persons = {}
+        for person in self._collection:
+            if person.get('name') and (single_person is None or person['name'] == single_person):
+                mongo_persons.setdefault(person['name'], person)
+
         # If no persons are found, return a message
         if not mongo_persons:
             return f"No person found with name: {single_person}"
-        
-        updates = []   # List to store entities that need updating
+
         update_details = []   # List to store update details for logging
-        
-        for person in mongo_persons:
-            try:
-                print("Processing person:", person['name'])
-                
-                # Query WissKI to find the URI of the person using predefined query
-                existing_uri = entity_uri(
-                    search_value=person['name'],
-                    query_string=self._query.get('person'),   # This query already includes {search_value}
-                    return_format='csv',
-                    value_input=True
-                )
-                
-                print("URI result:", existing_uri if not existing_uri.empty else "No URI found")
-                
-                # If the person exists in WissKI, proceed with updating
-                if not existing_uri.empty:
-                    fields = {
-                        self._field.get('f_person_name'): [person['name']]
-                    }
-                    
-                    # Handle affiliations
-                    affiliations = person.get('affiliation', [])
-                    if affiliations:
-                        print("Affiliations:", affiliations)
-                        
-                        # Get URIs for each institution affiliation
-                        current_affiliations = []
-                        for affiliation in affiliations:
-                            print(f"\nSearching for institution: {affiliation}")
-                            
-                            # Use the institution query from sparql_queries.json
-                            institution_uri = entity_uri(
-                                search_value=affiliation,
-                                query_string=self._query.get('institution'),
-                                return_format='csv',
-                                value_input=True
-                            )
-                            
-                            print("Institution search result:", 
-                                  institution_uri if not institution_uri.empty else "No institution found")
-                            
-                            # If institution URI is found, add it to the list
-                            if not institution_uri.empty:
-                                current_affiliations.append(institution_uri.iloc[0, 0])
-                                print(f"Found institution URI: {institution_uri.iloc[0, 0]}")
-                        
-                        # If any affiliations were found, add them to the fields
-                        if current_affiliations:
-                            fields[self._field.get('f_person_affiliation')] = current_affiliations
-                            update_details.append(f"{person['name']} -> {', '.join(affiliations)}")
-                        else:
-                            # If no affiliations were found, log a warning and show available institutions
-                            all_institutions = entity_uri(
-                                search_value=None,
-                                query_string=self._query.get('institutionlist'),
-                                return_format='csv',
-                                value_input=False
-                            )
-                            print("\nAvailable institutions in WissKI:")
-                            print(all_institutions)
-                            update_details.append(f"Warning: No institution URIs found for {person['name']}")
-                    else:
-                        update_details.append(f"{person['name']} -> no affiliations")
-                    
-                    # Create an Entity object for the person with updated fields
-                    person_entity = Entity(
-                        api=self._api,
-                        fields=fields,
-                        bundle_id=self._bundle.get('g_person'),
-                        uri=existing_uri.iloc[0, 0]
-                    )
-                    
-                    # Add the entity to the updates list
-                    updates.append(person_entity)
-                else:
-                    update_details.append(f"Warning: Could not find existing URI for {person['name']}")
-                    
-            except Exception as e:
-                # Log any errors encountered during processing
-                update_details.append(f"Error processing {person['name']}: {str(e)}")
-                import traceback
-                print("Full error:", traceback.format_exc())
+
+        # URIs of the persons and of all their affiliations (the cache is bypassed on purpose,
+        # persons and institutions may just have been created by a sync)
+        person_uris = entity_uri_batch(
+            list(mongo_persons), self._query.get('person'), cache={}, client=self._client
+        )
+        institution_uris = entity_uri_batch(
+            {affiliation for name in person_uris for affiliation in mongo_persons[name].get('affiliation') or []},
+            self._query.get('institution'), cache={}, client=self._client
+        )
+        current = self.current_affiliations(list(dict.fromkeys(person_uris.values())))
+
+        updates = []   # List to store entities that need updating
+        unchanged = 0
+        for name, person in mongo_persons.items():
+            if name not in person_uris:
+                update_details.append(f"Warning: Could not find existing URI for {name}")
                 continue
-        
+
+            affiliations = person.get('affiliation') or []
+            if not affiliations:
+                update_details.append(f"{name} -> no affiliations")
+                continue
+            for affiliation in affiliations:
+                if affiliation not in institution_uris:
+                    update_details.append(f"Warning: No institution URI found for {affiliation} ({name})")
+
+            # Institution URIs in the order of the Mongo record
+            new_affiliations = list(dict.fromkeys(
+                institution_uris[affiliation] for affiliation in affiliations if affiliation in institution_uris
+            ))
+            if not new_affiliations:
+                update_details.append(f"Warning: No institution URIs found for {name}")
+                continue
+            if set(new_affiliations) == current.get(person_uris[name]):
+                unchanged += 1
+                continue
+
+            update_details.append(f"{name} -> {', '.join(affiliations)}")
+            # Create an Entity object for the person with updated fields
+            updates.append(Entity(
+                api=self._api,
+                fields={
+                    self._field.get('f_person_name'): [name],
+                    self._field.get('f_person_affiliation'): new_affiliations
+                },
+                bundle_id=self._bundle.get('g_person'),
+                uri=person_uris[name]
+            ))
+
         # Perform updates for each entity in the updates list
         success_count = 0
-        for entity in updates:
+        for entity in updates if not dry_run else []:
             try:
                 self._api.save(entity)
                 success_count += 1
             except Exception as e:
                 update_details.append(f"Error saving entity: {str(e)}")
-        
+
         # Return a summary of the update process
-        summary = f"Successfully updated {success_count} out of {len(updates)} entities"
+        summary = (f"Successfully updated {success_count} out of {len(updates)} entities "
+                   f"({unchanged} unchanged)")
         details = "\n".join(update_details)
         return f"{summary}\n{details}"
 
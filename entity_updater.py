@@ -1,9 +1,12 @@
 # Libraries
 from entity_builder import DocumentEntity
+from field_registry import FIELDS, FieldEvaluator
 from wisski.api import Api, Entity
 from functions import entity_uri
+from sparql_client import SparqlClient
+from tracing import tracer
+from typing import MutableMapping
 from types import MethodType
-from pymongo import cursor
 
 # Summary
 """
@@ -25,7 +28,9 @@ class DocumentUpdate(DocumentEntity):
 
     def __init__(self, api: Api,
                  method: str | list[str],
-                 mongo_data: list):
+                 mongo_data: list,
+                 cache: MutableMapping[str, str] | None = None,
+                 client: SparqlClient | None = None):
 
         # Local initialisation
         self._api = api
@@ -34,219 +39,105 @@ class DocumentUpdate(DocumentEntity):
         self._edit_entity = None
 
         # Super class initialisation
-        super().__init__(api=self._api, return_value=True)
+        super().__init__(api=self._api, cache=cache, client=client)
+
+    def field_hashes(self, document: dict | None = None, fields: list[str] | None = None) -> dict:
+        """
+        Content hashes of the updated fields (see `DocumentEntity.field_hashes`).
+        """
+        if fields is None:
+            fields = [field_name for field_name in self._method if field_name in FIELDS]
+        return super().field_hashes(document, fields)
+
+    # Comparable form of field values (sub-bundle entities by their field values, not their URIs)
+    @classmethod
+    def _normalise(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, Entity):
+            return {
+                'bundle': value.bundle_id,
+                'fields': {k: cls._normalise(v) for k, v in value.fields.items() if cls._normalise(v) != []}
+            }
+        if isinstance(value, (list, tuple)):
+            return [cls._normalise(v) for v in value if v is not None]
+        return [str(value)]
 
     # Method match case method
-    def run(self, value_append: bool = False, new_value=None, dry_run=False):
-
-        for doc in self._bson_doc_list:
-
-            # Passing bson document
-            self.document(bson_document=doc)
-
-            # Initialising Entity to be edited
-            setattr(self,
-                    "_edit_entity",
-                    self._api.get_entity(
-                        entity_uri(
-                            search_value=doc.get('dre_id'),
-                            query_string=self._query.get('dreID')
-                        )
-                    )
-                    )
-
-            for _method_value in self._method:
-
-                kwargs = {
-                    "doc_id": doc.get('dre_id'),
-                    "method": _method_value,
-                    "dry_run": dry_run,
-                    "push_new_value": value_append,
-                    "push_value": new_value
-                    }
-
-                match _method_value:
-
-                    case 'collection':
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get("g_res_item_collection"),
-                            default_values=self.collection()
-                        )
-                    
-                    case 'project':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get("f_research_data_item_project"),
-                            default_values=self.project()
-                        )
-                    
-                    case 'subject':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get("f_research_data_item_subject"),
-                            default_values=self.subject()
-                        )
-
-                    case 'AssociatedEntities':
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get('g_research_data_item_ass_person'),
-                            default_values=self.role()
-                        )
-
-                    case 'IdentifierEntities':
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get('g_research_data_item_identifier'),
-                            default_values=self.identifier_entities()
-                        )
-
-                    case 'language':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_language'),
-                            default_values=self.language()
-                        )
-
-                    case 'citation':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_citation'),
-                            default_values=self.citation()
+    def run(self, value_append: bool = False, new_value=None, dry_run=False, documents: list[dict] | None = None) -> dict:
+        """
+        Update the requested fields of each document's entity.
+
+        Staged values are compared with the fields WissKI already holds: unchanged fields are
+        left alone, and each entity is saved at most once, with all its changed fields.
+        Returns the (DRE identifier, method) pairs that were changed, unchanged or failed.
+        """
+        summary = {'changed': [], 'unchanged': [], 'failed': []}
+
+        for doc in documents if documents is not None else self._bson_doc_list:
+
+            with tracer.span('document', dre_id=doc.get('dre_id')):
+                # Passing bson document
+                self.document(bson_document=doc)
+                self._field_functions.discard()
+
+                # Initialising Entity to be edited
+                with tracer.span('get_entity'):
+                    setattr(self,
+                            "_edit_entity",
+                            self._api.get_entity(
+                                entity_uri(
+                                    search_value=doc.get('dre_id'),
+                                    query_string=self._query.get('dreID'),
+                                    # Existence lookup, the cache is bypassed
+                                    cache={}, client=self._client
+                                )
                             )
-                        
-                    case 'copyright':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_copyright'),
-                            default_values=self.copyright()
-                        )
-
-                    case 'country':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_creat_country'),
-                            default_values=self.originlocation().get('l1')
                             )
 
-                    case 'region':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_creat_regio'),
-                            default_values=self.originlocation().get('l2')
-                            )
-
-                    case 'subregion':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_creat_subre'),
-                            default_values=self.originlocation().get('l3')
-                            )
+                changes = []
+                # Each builder runs at most once per document, only for the requested fields
+                evaluator = FieldEvaluator(self)
+                for _method_value in self._method:
 
-                    case 'currentLocation':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_located_at'),
-                            default_values=self.currentlocation()
-                            )
-
-                    case 'physicalDesc':
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get('g_reseach_data_item_res_type'),
-                            default_values=self.physicaldesc()
-                            )
-                        
-                    case 'TypeOfResource':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_type_res'),
-                            default_values=self.resource_type()
-                            )
-
-                    case 'note':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_note'),
-                            default_values=self.note()
-                            )
-                    
-                    case 'abstract':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_abstract'),
-                            default_values=self.abstract()
-                            )
-                    
-                    case 'tags':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_reseach_data_item_tag'),
-                            default_values=self.tags()
-                            )
-                    
-                    case 'targetAudience':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_target_audience'),
-                            default_values=self.target_audience()
-                            )
-                    
-                    case 'url':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_url'),
-                            default_values=self.url_link()
-                            )
-                    
-                    case 'mainTitle':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_title_main'),
-                            default_values=self.titles()['main']
-                        )
-                    
-                    case 'altTitle':
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get('g_research_data_item_title'),
-                            default_values=self.titles()['alt']
-                        )
-                    
-                    case 'createDate':                            
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_create_date'),
-                            default_values=self.dateinfo()['created']
-                        )
-                    
-                    case 'altDate':                            
-                        self.build(
-                            **kwargs,
-                            field_name=self._bundle.get('g_research_data_item_date_add'),
-                            default_values=self.dateinfo()['alt']
-                        )
-
-                    case 'repository':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_res_item_data_repository'),
-                            default_values=self.repository()
-                        )
-
-                    case 'genre':
-                        self.build(
-                            **kwargs,
-                            field_name=self._field.get('f_research_data_item_auth_tag'),
-                            default_values=self.genre()
-                        )
-                    
-                    case _:
+                    if _method_value not in FIELDS:
                         print(f'No field found with name {_method_value}')
+                        summary['failed'].append((doc.get('dre_id'), _method_value))
+                        continue
+
+                    status = self.build(
+                        doc_id=doc.get('dre_id'),
+                        method=_method_value,
+                        dry_run=dry_run,
+                        push_new_value=value_append,
+                        push_value=new_value,
+                        field_name=evaluator.target(_method_value),
+                        default_values=evaluator.value(_method_value)
+                    )
+
+                    if status == 'changed':
+                        changes.append(_method_value)
+                    else:
+                        summary[status].append((doc.get('dre_id'), _method_value))
+
+                # One save per entity, with all changed fields
+                if changes and not dry_run:
+                    print(f"Updating fields for the DRE ID: {doc.get('dre_id')}")
+                    try:
+                        with tracer.span('save'):
+                            self._api.save(self._edit_entity)
+                    except Exception as e:
+                        print(f"{', '.join(changes)} not updated: {e}")
+                        summary['failed'].extend((doc.get('dre_id'), m) for m in changes)
+                        continue
+                    # Newly created exception entities are known from now on
+                    self._field_functions.commit()
+                    print("{fields} updated!".format(fields=', '.join(changes)))
+                summary['changed'].extend((doc.get('dre_id'), m) for m in changes)
 
         if not dry_run:
             print("All updates completed.")
+        return summary
 
     def build(self,
               doc_id: str,
@@ -256,22 +147,26 @@ class DocumentUpdate(DocumentEntity):
               push_value=None,
               field_name=None,
               default_values: MethodType = None) -> str:
+        """
+        Stage the new value of one field on the entity; returns 'changed', 'unchanged' or 'failed'.
+        """
+        if field_name is None:
+            print("{field} was not updated. Please check values passed.".format(field=method))
+            return 'failed'
+
+        current_values = self._edit_entity.fields.get(field_name) or []
+        if push_new_value:
+            new_values = list(current_values) + [push_value]
+        elif default_values is None:
+            new_values = []
+        else:
+            new_values = default_values
+
+        if self._normalise(new_values) == self._normalise(current_values):
+            return 'unchanged'
         if dry_run:
             print("Dry run initiated, preview values given below:\n")
-            print(default_values)
+            print(new_values)
         else:
-            print(f"Updating fields for the DRE ID: {doc_id}")
-            try:
-                if push_new_value:
-                    self._edit_entity.fields[field_name] = self._edit_entity.fields[field_name].append(push_value)
-                    self._api.save(self._edit_entity)
-                else:
-                    if default_values == None:
-                        self._edit_entity.fields[field_name] = []
-                        self._api.save(self._edit_entity)
-                    else:
-                        self._edit_entity.fields[field_name] = default_values
-                        self._api.save(self._edit_entity)          
-                print("{field} updated!".format(field=method))
-            except KeyError:
-                print("{field} was not updated. Please check values passed.".format(field=method))
+            self._edit_entity.fields[field_name] = new_values
+        return 'changed'
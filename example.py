@@ -2,7 +2,13 @@ from tqdm import tqdm
 from wisski.api import Api
 
 import functions
+from bulk_import import BulkImport
 from entity_builder import DocumentEntity
+from metrics import InstrumentedApi, metrics
+from sparql_client import SparqlClient
+from tracing import tracer
+from uri_cache import SQLiteUriCache
+from vocabulary import VocabularyIndex
 
 # 1. Upload mongo-data to WissKI
 
@@ -10,11 +16,23 @@ from entity_builder import DocumentEntity
 api = Api("https://www.wisski.uni-bayreuth.de/wisski/api/v0", auth=("username", "password"), headers={"Cache-Control": "no-cache"})
 api.pathbuilders = ["amo_ecrm__v01_dev_pb"]
 
-# pathbuilder_save("https://www.wisski.uni-bayreuth.de/sites/default/files/wisski_pathbuilder/export/amo_ecrm__v01_dev_pb_20240821T122919")
+# Compile the bundle and field ids from a pathbuilder export (does nothing if they are current)
+# from path_extractor import compile_pathbuilder
+# compile_pathbuilder("https://www.wisski.uni-bayreuth.de/sites/default/files/wisski_pathbuilder/export/amo_ecrm__v01_dev_pb_20240821T122919")
 data = functions.mongodata_fetch("projects_metadata_ubt", "UBT_DigiRet2022")
 
+# One SPARQL client (keep-alive connection pool) for the whole run
+client = SparqlClient()
+
+# Controlled vocabularies (countries, languages, roles, ...) are answered from memory;
+# refresh the snapshot with `python vocabulary.py` after editing them in WissKI
+vocabulary = VocabularyIndex.from_file(client=client)
+
+# Entity URIs are kept on disk, so that a rerun on the same collection starts with a warm cache
+cache = SQLiteUriCache("cache/uri_cache.sqlite", ttl=7 * 24 * 3600, index=vocabulary)
+
 # Instantiate a Document entity Class object
-uploader = DocumentEntity(api)
+uploader = DocumentEntity(api, cache=cache, client=client)
 
 # For passing a data object to class
 uploader.document(data[0])
@@ -25,11 +43,33 @@ uploader.staging()
 # To uploaded staged data
 uploader.upload()
 
+# Resolve the vocabulary lookups of all documents with batched queries
+uploader.prefetch(data)
+
 # Iterate through documents to do multiple uploads
 for row in tqdm(data):
     uploader.document(row)
     uploader.upload()
 
+# Collections larger than memory: stream the documents (resume_after=<_id> continues an interrupted run)
+for row in tqdm(functions.mongodata_stream("projects_metadata_ubt", "UBT_DigiRet2022", batch_size=500)):
+    uploader.document(row)
+    uploader.upload()
+
+# Resumable import: saved items are journaled, a rerun after an interruption skips them.
+# Run metrics: the API is wrapped to measure saves, Prometheus metrics are served during the run and kept as a JSON report
+instrumented = DocumentEntity(InstrumentedApi(api), cache=cache, client=client)
+metrics.serve(9464)
+with BulkImport(instrumented, journal="cache/UBT_DigiRet2022.jsonl") as importer:
+    print(importer.run(tqdm(functions.mongodata_stream("projects_metadata_ubt", "UBT_DigiRet2022"))))
+metrics.save("cache/run_report.json")
+
+# Tracing: a span per document, builder method, SPARQL query and save (inspect with `python tracing.py cache/trace.jsonl`)
+tracer.enable("cache/trace.jsonl")
+uploader.document(data[0])
+uploader.upload()
+tracer.disable()
+
 
     
 # 2. WissKi entity sync-up
@@ -38,10 +78,13 @@ import entity_sync
 from entity_sync import EntitySync
 
 # Sync-up 'institutions' as an example (always update institutions before persons)
-institutions = EntitySync(api=api, sync_field='institutions')
+institutions = EntitySync(api=api, sync_field='institutions', client=client)
 
 # For list of missing entities 
 institutions.missing_entities()
+
+# Missing, extra (only in WissKI) and ambiguous (duplicate label) entities
+reconciliation = institutions.reconcile()
  
 # For staged Data
 institutions.staged()
@@ -62,13 +105,19 @@ from entity_builder import DocumentEntity
 api = Api("https://www.wisski.uni-bayreuth.de/wisski/api/v0", auth=("username", "password"), headers={"Cache-Control": "no-cache"})
 api.pathbuilders = ["amo_ecrm__v01_dev_pb"]
 
-# Example
+# Example (only the keys read by the requested fields are fetched from Mongo)
+update_methods = ['citation', 'language', 'subject']
 updater = DocumentUpdate(
 api=api,
-dre_identifier="aca-01-0000",
-method='subject' or ['citation', 'language', 'subject'],
-mongodb="projects_metadata_ubt",
-mongocoll="UBT_DigiRet2022"
+method=update_methods,
+mongo_data=functions.mongodata_fetch(
+    "projects_metadata_ubt", "UBT_DigiRet2022",
+    filter_str={"dre_id": "aca-01-0000"},
+    projection=DocumentUpdate.projection(update_methods)
+),
+client=client
 )
 
-updater.run()
+# Unchanged fields are skipped, each item is saved once with all changed fields
+summary = updater.run()
+print(f"{len(summary['changed'])} changed, {len(summary['unchanged'])} unchanged, {len(summary['failed'])} failed")
@@ -1,6 +1,10 @@
 # Libraries
-from functions import json_file
+from typing import MutableMapping
+
+from functions import cache_key, entity_uri_batch
 from auth import GeneralEntity
+from sparql_client import SparqlClient
+from uri_cache import UriCache
 
 # WissKi Api
 from wisski.api import Api, Pathbuilder, Entity
@@ -11,15 +15,18 @@ from wisski.api import Api, Pathbuilder, Entity
 
 class FieldFunctions(GeneralEntity):
 
-    def __init__(self, api: Api):
+    def __init__(self, api: Api, cache: MutableMapping[str, str] | None = None,
+                 client: SparqlClient | None = None):
 
         # Super Class
-        self._bundle = json_file("dicts/bundles.json")
-        self._field = json_file("dicts/fields.json")
-        self._query = json_file("dicts/sparql_queries.json")
-        self._language = json_file("dicts/lang.json")
+        super().__init__()
         self._api = api
 
+        # Entity URI cache and exception entities waiting to be saved
+        self._cache = cache if cache is not None else UriCache()
+        self._client = client
+        self._pending = []
+
         # Field Dictionary
         self._path_dict = {
             'language': {
@@ -55,8 +62,15 @@ class FieldFunctions(GeneralEntity):
         }
 
     # Generalised Exception Function
-    def exception(self, field_name: str):
-        def inner(entity_value, qualifier_value=None, with_qualifier=False):
+    def exception(self, field_name: str, query_string: str | None = None):
+        """
+        Returns a function creating the entity for a value missing in WissKI.
+
+        When the lookup query is given, the entity is remembered under the cache key of its
+        search value (default: the entity value), so that its URI can be written to the cache
+        once it was saved (see `commit`).
+        """
+        def inner(entity_value, qualifier_value=None, with_qualifier=False, search_value=None):
             if entity_value is not None:
                 fields_data = {self._path_dict.get(field_name).get('field'): [entity_value]}
                 if with_qualifier:
@@ -64,10 +78,41 @@ class FieldFunctions(GeneralEntity):
                 else:
                     pass
 
-                return Entity(api=self._api,
-                            fields=fields_data,
-                            bundle_id=self._path_dict.get(field_name).get('bundle'))
+                entity = Entity(api=self._api,
+                                fields=fields_data,
+                                bundle_id=self._path_dict.get(field_name).get('bundle'))
+                if query_string:
+                    self._pending.append(
+                        (search_value if search_value is not None else entity_value, query_string, entity)
+                    )
+                return entity
             else:
                 pass
 
         return inner
+
+    # Write-through of saved exception entities
+    def commit(self):
+        """
+        Write the URIs of the exception entities saved with the last document to the cache.
+
+        Entities that did not get their URI back from the API are resolved again, with one
+        batched query per lookup query, replacing the misses cached for them.
+        """
+        unresolved = {}
+        for search_value, query_string, entity in self._pending:
+            if getattr(entity, 'uri', None):
+                self._cache[cache_key(search_value, query_string)] = entity.uri
+            else:
+                unresolved.setdefault(query_string, []).append(search_value)
+        for query_string, search_values in unresolved.items():
+            resolved = entity_uri_batch(search_values, query_string, cache={}, client=self._client)
+            for search_value, uri in resolved.items():
+                self._cache[cache_key(search_value, query_string)] = uri
+        self._pending = []
+
+    def discard(self):
+        """
+        Forget exception entities that were staged but not saved.
+        """
+        self._pending = []
@@ -0,0 +1,183 @@
+# Libraries
+import asyncio
+from typing import NamedTuple
+
+from auth import GeneralEntity
+from metrics import metrics
+from tracing import tracer
+
+"""
+Declarative registry of the fields of a research data item.
+
+Every field names the `DocumentEntity` builder method producing its value, the part of the
+builder result it takes (for builders producing several fields) and its target field or
+bundle (a key of fields.json, or of bundles.json for keys starting with "g_"). Builders list
+the source document keys they read and the builders whose results they need.
+
+`FieldEvaluator` evaluates the fields of one document lazily: only the builders of the
+requested fields run, each at most once, after its dependencies.
+"""
+
+
+class Builder(NamedTuple):
+    source_keys: tuple[str, ...]
+    depends: tuple[str, ...] = ()
+
+
+class Field(NamedTuple):
+    builder: str
+    target: str
+    part: str | None = None
+
+
+# Builder method -> source keys and dependencies
+BUILDERS = {
+    'resource_type': Builder(('typeOfResource',)),
+    'project': Builder(('project',)),
+    'collection': Builder(('collection',)),
+    'identifier_entities': Builder(('dre_id', 'identifier')),
+    'language': Builder(('language',)),
+    'citation': Builder(('citation',)),
+    'originlocation': Builder(('location.origin',)),
+    'currentlocation': Builder(('location.current',)),
+    'url_link': Builder(('url',)),
+    'copyright': Builder(('accessCondition.rights',)),
+    'target_audience': Builder(('targetAudience',)),
+    'abstract': Builder(('abstract',)),
+    'tabel_of_content': Builder(('tableOfContents',)),
+    'note': Builder(('note',)),
+    'role': Builder(('sponsor', 'name')),
+    'titles': Builder(('titleInfo',)),
+    'dateinfo': Builder(('dateInfo',)),
+    'physicaldesc': Builder(('physicalDescription',)),
+    'technical_property': Builder(('physicalDescription.tech',)),
+    'genre_authority': Builder(('genre',)),
+    'genre': Builder(('genre',), depends=('genre_authority',)),
+    'subject': Builder(('subject',)),
+    'tags': Builder(('tags',)),
+    'preview_image': Builder(('previewImage',)),
+    'repository': Builder(('dre_id',))
+}
+
+# Field (update method) -> builder, target and part of the builder result, in staging order
+FIELDS = {
+    'TypeOfResource': Field('resource_type', 'f_research_data_item_type_res'),
+    'project': Field('project', 'f_research_data_item_project'),
+    'collection': Field('collection', 'g_res_item_collection'),
+    'IdentifierEntities': Field('identifier_entities', 'g_research_data_item_identifier'),
+    'language': Field('language', 'f_research_data_item_language'),
+    'citation': Field('citation', 'f_research_data_item_citation'),
+    'country': Field('originlocation', 'f_research_data_creat_country', 'l1'),
+    'region': Field('originlocation', 'f_research_data_item_creat_regio', 'l2'),
+    'subregion': Field('originlocation', 'f_research_data_item_creat_subre', 'l3'),
+    'currentLocation': Field('currentlocation', 'f_research_data_item_located_at'),
+    'url': Field('url_link', 'f_research_data_item_url'),
+    'copyright': Field('copyright', 'f_research_data_item_copyright'),
+    'targetAudience': Field('target_audience', 'f_research_data_target_audience'),
+    'abstract': Field('abstract', 'f_research_data_abstract'),
+    'tableOfContents': Field('tabel_of_content', 'f_research_data_item_toc'),
+    'note': Field('note', 'f_research_data_note'),
+    'AssociatedEntities': Field('role', 'g_research_data_item_ass_person'),
+    'mainTitle': Field('titles', 'f_research_data_item_title_main', 'main'),
+    'altTitle': Field('titles', 'g_research_data_item_title', 'alt'),
+    'createDate': Field('dateinfo', 'f_research_data_item_create_date', 'created'),
+    'altDate': Field('dateinfo', 'g_research_data_item_date_add', 'alt'),
+    'physicalDesc': Field('physicaldesc', 'g_reseach_data_item_res_type'),
+    'technicalProperty': Field('technical_property', 'f_reseach_data_item_tech_prop'),
+    'genre': Field('genre', 'f_research_data_item_auth_tag'),
+    'subject': Field('subject', 'f_research_data_item_subject'),
+    'tags': Field('tags', 'f_reseach_data_item_tag'),
+    'previewImage': Field('preview_image', 'f_research_data_item_prv_img_url'),
+    'repository': Field('repository', 'f_res_item_data_repository')
+}
+
+
+def builders_for(field_names: list[str] | None = None) -> list[str]:
+    """
+    Builders needed for the given fields (default: all), each after its dependencies.
+    """
+    ordered = {}
+
+    def add(builder: str):
+        for dependency in BUILDERS[builder].depends:
+            add(dependency)
+        ordered.setdefault(builder)
+
+    for field_name in field_names if field_names is not None else FIELDS:
+        add(FIELDS[field_name].builder)
+    return list(ordered)
+
+
+def source_keys(field_names: list[str] | None = None) -> set[str]:
+    """
+    Source document keys read for the given fields (default: all).
+    """
+    return {key for builder in builders_for(field_names) for key in BUILDERS[builder].source_keys}
+
+
+class FieldEvaluator:
+    """
+    Lazily evaluated fields of the current document of a `DocumentEntity`.
+    """
+
+    def __init__(self, entity: GeneralEntity):
+        self._entity = entity
+        self._results = {}
+
+    def target(self, field_name: str) -> str | None:
+        """
+        Field or bundle id of a field.
+        """
+        target = FIELDS[field_name].target
+        return self._entity._bundle.get(target) if target.startswith('g_') else self._entity._field.get(target)
+
+    def builder_value(self, builder: str):
+        if builder not in self._results:
+            dependencies = {dependency: self.builder_value(dependency) for dependency in BUILDERS[builder].depends}
+            self._results[builder] = self._timed(builder, dependencies)
+        return self._results[builder]
+
+    def value(self, field_name: str):
+        field = FIELDS[field_name]
+        result = self.builder_value(field.builder)
+        if field.part is not None:
+            return (result or {}).get(field.part)
+        return result
+
+    def staged(self, field_names: list[str] | None = None) -> dict:
+        """
+        Target -> value of the given fields (default: all), leaving out fields without value.
+        """
+        staged = {}
+        for field_name in field_names if field_names is not None else FIELDS:
+            value = self.value(field_name)
+            if value is not None and value != [] and value != {}:
+                staged[self.target(field_name)] = value
+        return staged
+
+    def _timed(self, builder: str, dependencies: dict):
+        with metrics.timer('builders', builder=builder), tracer.span('builder', builder=builder):
+            return getattr(self._entity, builder)(**dependencies)
+
+    async def evaluate_async(self, field_names: list[str] | None = None, concurrency: int = 8):
+        """
+        Run the builders of the given fields (default: all) concurrently in worker threads.
+
+        A builder starts once its dependencies are done; at most `concurrency` run at a time.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = {}
+
+        def schedule(builder: str):
+            if builder not in tasks:
+                tasks[builder] = asyncio.ensure_future(run(builder))
+            return tasks[builder]
+
+        async def run(builder: str):
+            dependencies = {dependency: await schedule(dependency) for dependency in BUILDERS[builder].depends}
+            if builder not in self._results:
+                async with semaphore:
+                    self._results[builder] = await asyncio.to_thread(self._timed, builder, dependencies)
+            return self._results[builder]
+
+        await asyncio.gather(*(schedule(builder) for builder in builders_for(field_names)))
@@ -6,15 +6,24 @@ Created on Tue May 28 15:17:50 2024
 """
 
 # Library Imports
+import asyncio
+import functools
 import io
 import json
-from typing import Callable, NamedTuple, Union, MutableMapping
+import re
+from collections import namedtuple
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple, Union, MutableMapping
 
 from pathlib import Path
 
-import pandas as pd
-from pymongo import MongoClient
-from SPARQLWrapper import CSV, JSON, SPARQLWrapper
+from metrics import metrics, query_key
+from sparql_client import SparqlClient, default_client
+from tracing import tracer
+from uri_cache import UriCache, query_fingerprint
+
+# pandas and pymongo are imported where they are used, so that importing the builders stays fast
+if TYPE_CHECKING:
+    from pymongo import MongoClient
 
 # Function for fetching all documents belong to a DB and Collection
 
@@ -30,20 +39,119 @@ def load_config(config_file='dicts/functions_config.json'):
         raise ValueError(f"Invalid JSON in config file: {config_path}")
 
 
-def mongodata_fetch(db_name, collection_name, as_list: bool = True, filter_str: dict | None = None):
+@functools.cache
+def mongo_client() -> "MongoClient":
+    """
+    Mongo client shared by all reads of a run (it maintains its own connection pool).
+    """
+    from pymongo import MongoClient
+
     config = load_config()
-    client = MongoClient(config['mongo_uri'])
+    return MongoClient(config['mongo_uri'])
+
+
+def mongodata_fetch(db_name, collection_name, as_list: bool = True, filter_str: dict | None = None,
+                    projection: dict | None = None):
+    client = mongo_client()
     db = client[db_name]
     collection = db[collection_name]
     if as_list:
         if filter_str:
-            return list(collection.find(filter_str))
+            return list(collection.find(filter_str, projection))
         else:
-            return list(collection.find())
+            return list(collection.find({}, projection))
     else:
         return collection
 
 
+def mongodata_stream(
+    db_name: str,
+    collection_name: str,
+    filter_str: dict | None = None,
+    batch_size: int = 500,
+    sort: list[tuple[str, int]] | None = None,
+    resume_after=None,
+    projection: dict | None = None,
+) -> Iterator[dict]:
+    """
+    Stream the documents of a collection instead of materialising them as a list.
+
+    Documents are fetched from the server in batches of `batch_size`, sorted by `_id` unless
+    another `sort` is given. With `resume_after` (an `_id`), only documents after it are
+    returned, which requires the `_id` order; when sorting by `_id`, an expired server cursor
+    is resumed the same way.
+    """
+    from pymongo.errors import CursorNotFound
+
+    sort = sort or [('_id', 1)]
+    if resume_after is not None and sort != [('_id', 1)]:
+        raise ValueError("resume_after requires documents sorted by _id")
+
+    # Resuming needs the _id of each document, it is dropped again if the projection excludes it
+    drop_id = projection is not None and not projection.get('_id', True)
+    if drop_id:
+        # _id is returned unless excluded, for inclusion and exclusion projections alike
+        projection = {k: v for k, v in projection.items() if k != '_id'} or None
+
+    collection = mongo_client()[db_name][collection_name]
+    last_id = resume_after
+    while True:
+        query = dict(filter_str or {})
+        if last_id is not None:
+            query = {'$and': [query, {'_id': {'$gt': last_id}}]} if query else {'_id': {'$gt': last_id}}
+        cursor = collection.find(query, projection, batch_size=batch_size, sort=sort)
+        try:
+            for doc in cursor:
+                last_id = doc.get('_id')
+                if drop_id:
+                    del doc['_id']
+                yield doc
+            return
+        except CursorNotFound:
+            # Long-running imports can outlive the server cursor, resume after the last document
+            if sort != [('_id', 1)]:
+                raise
+        finally:
+            cursor.close()
+
+
+# Entity URI cache shared by all lookups that are not given a cache of their own
+_uri_cache = UriCache()
+
+# Number of values sent to GraphDB in a single VALUES block
+BATCH_SIZE = 200
+
+
+# Characters that cannot appear unescaped in a "..." SPARQL string literal
+_LITERAL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def escape_value(value: str) -> str:
+    """
+    Escape double quotes, backslashes and line breaks for use inside a SPARQL string literal.
+    """
+    return value.translate(_LITERAL_ESCAPES)
+
+
+def cache_key(search_value: Union[str, NamedTuple], query_string: str) -> str:
+    """
+    Key under which the URI of a search value is cached for a given query.
+
+    The key is built from the query template fingerprint and the escaped search value
+    (all fields, for named tuples), so it is the same in every process and run.
+    """
+    if isinstance(search_value, tuple) and hasattr(search_value, '_asdict'):
+        value_key = json.dumps(
+            {k: escape_value(v) if isinstance(v, str) else v for k, v in search_value._asdict().items()},
+            sort_keys=True, default=str
+        )
+    elif isinstance(search_value, str):
+        value_key = escape_value(search_value)
+    else:
+        value_key = str(search_value)
+    return f"{query_fingerprint(query_string)}:{value_key}"
+
+
 # Function for the entity retrieval
 # This function checks for the existence of entity and return the WissKI for the same,
 
@@ -54,62 +162,244 @@ def entity_uri(
     return_format="json",
     value_input=True,
     conditional=False,
-    cache: MutableMapping[str, str] = {},
+    cache: MutableMapping[str, str] | None = None,
+    client: SparqlClient | None = None,
 ) -> str | object | None:
-    cache_key = f"{search_value}_{hash(query_string)}"
-    if cache_key in cache:
-        return cache[cache_key]
+    # Misses are only remembered by a cache the caller passed in; the shared default cache
+    # keeps found URIs only, so that entities created meanwhile are found by later lookups
+    store_misses = cache is not None
+    if cache is None:
+        cache = _uri_cache
+    _key = cache_key(search_value, query_string)
+    # One lookup: an entry expiring between a membership test and the read would raise KeyError
+    try:
+        cached = cache[_key]
+    except KeyError:
+        metrics.count('cache_lookups', query=query_key(query_string), result='miss')
+    else:
+        metrics.count('cache_lookups', query=query_key(query_string), result='hit')
+        return cached
+
+    if client is None:
+        client = default_client()
 
-    # Load graphdb sparql configuration
-    config = load_config()
-    format_dict = {'json': JSON, 'csv': CSV}
-    sparql = SPARQLWrapper(config['sparql_endpoint'])
-    sparql.setReturnFormat(format_dict[return_format])
-    sparql.setHTTPAuth('BASIC')
-    sparql.setCredentials(config['sparql_username'], config['sparql_password'])
-    
     if value_input:
         if not conditional:
             # If search_value is a string, escape any special characters for SPARQL
             if isinstance(search_value, str):
                 # Double quotes and backslashes need to be escaped in SPARQL
-                escaped_value = search_value.replace('\\', '\\\\').replace('"', '\\"')
+                escaped_value = escape_value(search_value)
                 
                 # Use the escaped value in the query
                 formatted_query = query_string.format(search_value=escaped_value)
             else:
                 formatted_query = query_string.format(search_value=search_value)
-                
-            sparql.setQuery(formatted_query)
         elif conditional:
             assert isinstance(search_value, tuple)
             # Escape any string values in the tuple
             escaped_dict = {}
             for key, value in search_value._asdict().items():
                 if isinstance(value, str):
-                    escaped_dict[key] = value.replace('\\', '\\\\').replace('"', '\\"')
+                    escaped_dict[key] = escape_value(value)
                 else:
                     escaped_dict[key] = value
                     
-            sparql.setQuery(query_string.format(**escaped_dict))
+            formatted_query = query_string.format(**escaped_dict)
     elif not value_input:
-        sparql.setQuery(query_string)
+        formatted_query = query_string
 
-    query_response = sparql.queryAndConvert()
+    with metrics.timer('sparql_queries', query=query_key(query_string), kind='single'), \
+            tracer.span('sparql_query', query=query_key(query_string), kind='single'):
+        query_response = client.query(formatted_query, return_format)
     
     if return_format == 'json':
-        try:
-            val = str(query_response["results"]["bindings"][0]["id"]["value"])
-            cache[cache_key] = val
-            return val
-        except IndexError:
+        rows = result_rows(query_response)
+        if not rows or rows[0].id is None:
+            # Misses are only cached where they expire again
+            if store_misses and isinstance(cache, UriCache):
+                cache[_key] = None
             return None
+        val = str(rows[0].id)
+        cache[_key] = val
+        return val
     elif return_format == 'csv':
+        import pandas as pd
         try:
             return pd.read_csv(io.StringIO(query_response.decode('utf-8')))
         except IndexError:
             return None
 
+
+async def entity_uri_async(search_value: Union[str, NamedTuple], query_string: str, **kwargs) -> str | object | None:
+    """
+    Asynchronous variant of `entity_uri`, taking the same arguments.
+
+    The lookup runs in a worker thread, so that independent lookups can be awaited concurrently
+    while sharing the locked cache and the SPARQL client (which gives each thread its own session).
+    """
+    return await asyncio.to_thread(entity_uri, search_value, query_string, **kwargs)
+
+
+# Placeholders of the sparql_queries.json templates that can be turned into VALUES variables
+_LITERAL_PLACEHOLDER = re.compile(r'"\{(\w+)\}"@en')
+_IRI_PLACEHOLDER = re.compile(r'\b(\w+):\{(\w+)\}')
+_PREFIX_DECLARATION = re.compile(r'PREFIX\s+(\w*):\s*<([^>]+)>')
+
+
+def values_query(query_string: str, search_values: Iterable[Union[str, NamedTuple]]) -> tuple[str, list[str]]:
+    """
+    Rewrite a single value query template into a query resolving many values at once.
+
+    Every placeholder of the template becomes a variable bound by a VALUES block and is
+    added to the projection, so that each result row can be matched with its search value.
+    Returns the query together with the names of the placeholder variables.
+    """
+    literal_vars = _LITERAL_PLACEHOLDER.findall(query_string)
+    iri_vars = {var: prefix for prefix, var in _IRI_PLACEHOLDER.findall(query_string)}
+    variables = literal_vars + [var for var in iri_vars if var not in literal_vars]
+
+    batch_query = _LITERAL_PLACEHOLDER.sub(r'?\1', query_string)
+    batch_query = _IRI_PLACEHOLDER.sub(r'?\2', batch_query)
+    batch_query = batch_query.replace('{{', '{').replace('}}', '}')
+
+    rows = []
+    for search_value in search_values:
+        row_values = search_value._asdict() if isinstance(search_value, tuple) else {'search_value': search_value}
+        terms = []
+        for var in variables:
+            if var in iri_vars:
+                terms.append(f"{iri_vars[var]}:{row_values[var]}")
+            else:
+                terms.append(f'"{escape_value(row_values[var])}"@en')
+        rows.append(f"({' '.join(terms)})")
+
+    var_list = ' '.join(f"?{var}" for var in variables)
+    values_block = f"VALUES ({var_list}) {{ {' '.join(rows)} }}"
+    batch_query = re.sub(r'WHERE\s*\{', lambda m: f"WHERE {{\n    {values_block}", batch_query, count=1)
+    batch_query = re.sub(r'SELECT\s+(.*?)\s*WHERE', lambda m: f"SELECT {m.group(1)} {var_list} WHERE",
+                         batch_query, count=1, flags=re.DOTALL)
+    return batch_query, variables
+
+
+def entity_uri_batch(
+    search_values: Iterable[Union[str, NamedTuple]],
+    query_string: str,
+    cache: MutableMapping[str, str] | None = None,
+    batch_size: int = BATCH_SIZE,
+    client: SparqlClient | None = None,
+) -> dict:
+    """
+    Resolve many search values of one query template with VALUES queries.
+
+    Found URIs are written to the cache under the same keys `entity_uri` uses, so that
+    subsequent single lookups are answered from the cache. Values without a match are
+    left out of the returned dictionary and cached as misses by a `UriCache` passed in.
+    """
+    store_misses = cache is not None
+    if cache is None:
+        cache = _uri_cache
+    if client is None:
+        client = default_client()
+    # Only string values (or named tuples of strings) can be bound in a VALUES block
+    pending = [
+        value for value in dict.fromkeys(search_values)
+        if (isinstance(value, str) or isinstance(value, tuple) and all(isinstance(v, str) for v in value))
+        and cache_key(value, query_string) not in cache
+    ]
+    prefixes = {prefix: iri for prefix, iri in _PREFIX_DECLARATION.findall(query_string)}
+    iri_vars = {var: prefix for prefix, var in _IRI_PLACEHOLDER.findall(query_string)}
+
+    resolved = {}
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        batch_query, variables = values_query(query_string, chunk)
+
+        # Results are matched back on the placeholder values of each row
+        lookup = {}
+        for search_value in chunk:
+            row_values = search_value._asdict() if isinstance(search_value, tuple) else {'search_value': search_value}
+            lookup[tuple(str(row_values[var]) for var in variables)] = search_value
+
+        with metrics.timer('sparql_queries', query=query_key(query_string), kind='batch'), \
+                tracer.span('sparql_query', query=query_key(query_string), kind='batch', values=len(chunk)):
+            query_response = client.query(batch_query)
+        metrics.count('batch_values', len(chunk), query=query_key(query_string))
+
+        for row in result_rows(query_response):
+            values = []
+            for var in variables:
+                value = getattr(row, var)
+                if var in iri_vars and value is not None:
+                    value = value.removeprefix(prefixes.get(iri_vars[var], ''))
+                values.append(value)
+            search_value = lookup.get(tuple(values))
+            if search_value is not None and row.id is not None and search_value not in resolved:
+                resolved[search_value] = str(row.id)
+                cache[cache_key(search_value, query_string)] = resolved[search_value]
+
+        if store_misses and isinstance(cache, UriCache):
+            for search_value in chunk:
+                if search_value not in resolved:
+                    cache[cache_key(search_value, query_string)] = None
+    return resolved
+
+
+@functools.cache
+def _row_type(variables: tuple[str, ...]) -> type:
+    return namedtuple('Row', variables, rename=True)
+
+
+def result_rows(query_response: dict) -> list[tuple]:
+    """
+    Rows of a JSON query result as named tuples of the selected variables (None where unbound).
+    """
+    variables = tuple(query_response["head"]["vars"])
+    row_type = _row_type(variables)
+    return [row_type(*(binding[var]["value"] if var in binding else None for var in variables))
+            for binding in query_response["results"]["bindings"]]
+
+
+# Number of rows fetched per page by entity_list_stream
+LIST_PAGE_SIZE = 5000
+
+
+def _string_literal(value: str) -> str:
+    return f'"{escape_value(value)}"'
+
+
+def entity_list_stream(
+    query_string: str,
+    page_size: int = LIST_PAGE_SIZE,
+    client: SparqlClient | None = None,
+) -> Iterator[tuple[str, str]]:
+    """
+    Stream the (URI, label) rows of a list query (selecting ?id and ?labelValue) page by page.
+
+    Pages are read with keyset pagination on the URI and label: every page continues after
+    the last row of the previous one, so that no page has to skip over the rows before it
+    and memory stays constant however large the bundle is.
+    """
+    if client is None:
+        client = default_client()
+    body, closing = query_string.rsplit('}', 1)
+    last = None
+    while True:
+        keyset = ''
+        if last is not None:
+            uri, label = map(_string_literal, last)
+            keyset = (f"    FILTER(STR(?id) > {uri} || (STR(?id) = {uri} && STR(?labelValue) > {label}))\n")
+        page_query = (f"{body}{keyset}}}{closing}\n"
+                      f"ORDER BY STR(?id) STR(?labelValue)\nLIMIT {page_size}")
+        with metrics.timer('sparql_queries', query=query_key(query_string), kind='list'), \
+                tracer.span('sparql_query', query=query_key(query_string), kind='list'):
+            rows = result_rows(client.query(page_query))
+        for row in rows:
+            last = (row.id, row.labelValue)
+            yield last
+        if len(rows) < page_size:
+            return
+
+
 def json_file(file_path: str):
     """
     Retrieve json files from disk.
@@ -118,14 +408,16 @@ def json_file(file_path: str):
         return json.load(file_obj)
 
 
-def entity_list_generate(value_list, query_name, exception_function: Callable = None, with_exception=False):
+def entity_list_generate(value_list, query_name, exception_function: Callable = None, with_exception=False,
+                         cache: MutableMapping[str, str] | None = None, client: SparqlClient | None = None):
     """
     Generate a list of wisski entities for given values.
     """
     entity_list = []
     for entity_value in value_list:
-        uri_value = entity_uri(entity_value, query_name)
+        uri_value = entity_uri(entity_value, query_name, cache=cache, client=client)
         if uri_value is None:
+            metrics.count('unresolved_values', query=query_key(query_name))
             if with_exception:
                 entity_list.append(exception_function(entity_value=entity_value))
             elif not with_exception:
@@ -134,6 +426,43 @@ def entity_list_generate(value_list, query_name, exception_function: Callable =
             entity_list.append(uri_value)
     return entity_list
 
+async def entity_list_generate_async(value_list, query_name, exception_function: Callable = None,
+                                     with_exception=False, cache: MutableMapping[str, str] | None = None,
+                                     client: SparqlClient | None = None, concurrency: int = 8):
+    """
+    Asynchronous variant of `entity_list_generate`, resolving up to `concurrency` values at a time.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def lookup(entity_value):
+        async with semaphore:
+            return await entity_uri_async(entity_value, query_name, cache=cache, client=client)
+
+    uri_values = await asyncio.gather(*(lookup(entity_value) for entity_value in value_list))
+
+    entity_list = []
+    for entity_value, uri_value in zip(value_list, uri_values):
+        if uri_value is None:
+            metrics.count('unresolved_values', query=query_key(query_name))
+            if with_exception:
+                entity_list.append(exception_function(entity_value=entity_value))
+            elif not with_exception:
+                entity_list.append(entity_value)
+        else:
+            entity_list.append(uri_value)
+    return entity_list
+
+# Null check of scalars (replaces pd.isna)
+
+
+def is_null(value) -> bool:
+    """
+    Whether a scalar is missing (None or NaN), as `pandas.isna` for scalars.
+    """
+    # NaN (and NaT) is the only value not equal to itself
+    return value is None or value != value
+
+
 # Try Function (NameError)
 
 
@@ -0,0 +1,80 @@
+# Libraries
+import json
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, NamedTuple
+
+"""
+Process-wide registry of the mapping dictionaries: bundle and field ids (compiled from the
+pathbuilder export), SPARQL query templates and language codes.
+
+The dictionaries are read from dicts/ once, on first use, into a read-only snapshot shared
+by all entity classes. `mappings.reload()` swaps in a new snapshot (the pathbuilder compiler
+does so after compiling new mappings); instances created before keep the snapshot they were
+created with.
+"""
+
+
+class Mappings(NamedTuple):
+    bundles: Mapping[str, str]
+    fields: Mapping[str, str]
+    queries: Mapping[str, str]
+    languages: Mapping[str, str]
+    version: str | None = None
+
+
+def _read(path: Path) -> Mapping:
+    with open(path) as file_obj:
+        return MappingProxyType(json.load(file_obj))
+
+
+class MappingRegistry:
+    """
+    Lazily loaded, hot-swappable snapshot of the mapping dictionaries.
+    """
+
+    def __init__(self, dicts_dir: str = "dicts"):
+        self._dicts_dir = Path(dicts_dir)
+        self._lock = threading.Lock()
+        self._current = None
+
+    def _load(self) -> Mappings:
+        manifest = self._dicts_dir / "pathbuilder_manifest.json"
+        version = None
+        if manifest.is_file():
+            with open(manifest) as file_obj:
+                version = json.load(file_obj).get('version')
+        return Mappings(
+            bundles=_read(self._dicts_dir / "bundles.json"),
+            fields=_read(self._dicts_dir / "fields.json"),
+            queries=_read(self._dicts_dir / "sparql_queries.json"),
+            languages=_read(self._dicts_dir / "lang.json"),
+            version=version
+        )
+
+    def current(self) -> Mappings:
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    self._current = self._load()
+                current = self._current
+        return current
+
+    def reload(self) -> Mappings:
+        """
+        Read the dictionaries again and make them the current snapshot.
+        """
+        mappings = self._load()
+        with self._lock:
+            self._current = mappings
+        return mappings
+
+    @property
+    def dicts_dir(self) -> Path:
+        return self._dicts_dir
+
+
+# Registry shared by all entity classes
+mappings = MappingRegistry()
@@ -0,0 +1,231 @@
+# Libraries
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from mappings import mappings
+from uri_cache import query_fingerprint
+
+"""
+Run metrics of the importers: counters and latency histograms.
+
+SPARQL lookups are labelled with the key of their query in sparql_queries.json, builder
+methods with their name and API calls with the method called. All measurements go to the
+process-wide `metrics` registry, which can be written as a JSON run report or served in the
+Prometheus text format for long runs:
+
+    metrics.serve(9464)                  # http://localhost:9464/metrics
+    ...
+    metrics.save("cache/run_report.json")
+
+Wrap the API client in an `InstrumentedApi` to measure saves and entity fetches.
+"""
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count', 'max')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+
+def _label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Thread-safe registry of labelled counters and latency histograms.
+    """
+
+    def __init__(self, prefix: str = "wisski_import"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self._started = time.time()
+
+    def count(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observe the duration of the block; exceptions are counted as `<name>_errors`.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.count(f"{name}_errors", **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def report(self) -> dict:
+        """
+        Machine-readable snapshot of all counters and histograms.
+        """
+        with self._lock:
+            elapsed = time.time() - self._started
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), 'count': h.count, 'sum': h.sum,
+                           'mean': h.sum / h.count if h.count else 0.0, 'max': h.max,
+                           'buckets': {str(bound): n for bound, n in zip(BUCKETS, h.counts)}}
+                          for (name, labels), h in sorted(self._histograms.items())]
+        saves = sum(h['count'] for h in histograms if h['name'] == 'api_calls' and h['labels'].get('method') == 'save')
+        return {
+            'started': self._started,
+            'elapsed_seconds': elapsed,
+            'saves_per_second': saves / elapsed if elapsed else 0.0,
+            'counters': counters,
+            'histograms': histograms
+        }
+
+    def save(self, path: str = "cache/run_report.json"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as file_obj:
+            json.dump(self.report(), file_obj, indent=2)
+
+    def prometheus(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        def label_text(labels, **extra):
+            pairs = [*labels, *extra.items()]
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {self._prefix}_{name}_total counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{self._prefix}_{name}_total{label_text(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {self._prefix}_{name}_seconds histogram")
+                for (histogram_name, labels), h in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(BUCKETS, h.counts):
+                        cumulative += n
+                        le = "+Inf" if bound == float('inf') else bound
+                        lines.append(f"{self._prefix}_{name}_seconds_bucket{label_text(labels, le=le)} {cumulative}")
+                    lines.append(f"{self._prefix}_{name}_seconds_sum{label_text(labels)} {h.sum}")
+                    lines.append(f"{self._prefix}_{name}_seconds_count{label_text(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = 9464, address: str = "") -> ThreadingHTTPServer:
+        """
+        Serve the Prometheus text format on /metrics from a background thread.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+# Registry shared by all instrumented code
+metrics = Metrics()
+
+
+# Fingerprints of the current query templates, rebuilt when the mappings are reloaded
+_query_keys = (None, {})
+
+
+@functools.lru_cache(maxsize=256)
+def _fingerprint(query_string: str) -> str:
+    return query_fingerprint(query_string)
+
+
+def query_key(query_string: str) -> str:
+    """
+    Key of a query template in sparql_queries.json (its fingerprint if it is not listed).
+    """
+    global _query_keys
+    queries, keys = _query_keys
+    current = mappings.current().queries
+    if queries is not current:
+        keys = {query_fingerprint(query): key for key, query in current.items()}
+        _query_keys = (current, keys)
+    fingerprint = _fingerprint(query_string)
+    return keys.get(fingerprint, fingerprint)
+
+
+class InstrumentedApi:
+    """
+    Proxy of a `wisski.api.Api` measuring `save` and `get_entity`; everything else is passed through.
+    """
+
+    def __init__(self, api):
+        self._api = api
+
+    def save(self, entity):
+        with metrics.timer('api_calls', method='save'):
+            return self._api.save(entity)
+
+    def get_entity(self, uri: str):
+        with metrics.timer('api_calls', method='get_entity'):
+            return self._api.get_entity(uri)
+
+    def __getattr__(self, name):
+        return getattr(self._api, name)
+
+    def __setattr__(self, name, value):
+        if name == '_api':
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._api, name, value)
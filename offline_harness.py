@@ -0,0 +1,360 @@
+# Libraries
+import copy
+import itertools
+import json
+import threading
+import time
+
+from rdflib import Graph, Literal, Namespace, RDF, URIRef
+from wisski.api import Entity
+
+from mappings import mappings
+
+"""
+Offline harness for running the importers end-to-end without GraphDB or WissKI.
+
+`LocalSparqlClient` answers the queries of sparql_queries.json from a local rdflib store
+loaded with the fixture triples below (and any Turtle files given), with the interface of
+`sparql_client.SparqlClient`. `FakeApi` stands in for `wisski.api.Api`: it records every
+save/get_entity payload, assigns URIs to saved entities and can simulate request latency.
+`fixture_document` returns Mongo documents whose values are known to the fixture store.
+Given the client as `store`, `FakeApi` adds the items and vocabulary entities it saves to
+the local store, so that lookups after a save resolve as they would against GraphDB.
+
+Run an end-to-end pass over the fixture documents with:
+
+    python offline_harness.py 100
+"""
+
+AM = Namespace("http://www.wisski.uni-bayreuth.de/ontologies/africamultiple/240307/")
+ECRM = Namespace("http://erlangen-crm.org/240307/")
+DATA = Namespace("http://www.wisski.uni-bayreuth.de/data/")
+
+# Identifier of the linked data identifier source (see the ldID query)
+_LD_SOURCE = "66bcb03418267"
+
+# (URI slug, class, English label) of the vocabulary entities identified by an appellation
+FIXTURE_ENTITIES = [
+    ('text', AM.information_carrier_type, "Text"),
+    ('dataset', AM.information_carrier_type, "Dataset"),
+    ('dre_identifier', ECRM.E32_Authority_Document, "DRE Identifier"),
+    ('doi', ECRM.E32_Authority_Document, "DOI"),
+    ('marc', ECRM.E32_Authority_Document, "MARC Genre Term List"),
+    ('english', ECRM.E56_Language, "English"),
+    ('french', ECRM.E56_Language, "French"),
+    ('kenya', AM.country, "Kenya"),
+    ('nigeria', AM.country, "Nigeria"),
+    ('bayreuth', ECRM.E53_Place, "Bayreuth"),
+    ('cc_by', ECRM.E30_Right, "CC BY"),
+    ('public', AM.audience, "Public"),
+    ('sponsor_role', AM.role, "Sponsor"),
+    ('author_role', AM.role, "Author"),
+    ('dfg', ECRM.E39_Actor, "DFG"),
+    ('history', AM.subject, "History"),
+    ('foo', AM.key_word, "foo"),
+    ('bar', AM.key_word, "bar"),
+    ('ubt', AM.institution, "University of Bayreuth"),
+    ('research_group', ECRM.E74_Group, "Research Group")
+]
+
+
+# Bundle -> (class, label field, qualifier field, qualifier property) of the vocabulary
+# entities created by the exception functions (see exception_functions.FieldFunctions)
+SAVED_VOCABULARIES = {
+    'g_tag': (AM.key_word, 'f_tag_name', None, None),
+    'g_iso_language': (ECRM.E56_Language, 'f_iso_language_identifier', None, None),
+    'g_audience': (AM.audience, 'f_audience_description', None, None),
+    'g_funding_body': (ECRM.E39_Actor, 'f_funding_body_name', None, None),
+    'g_place': (ECRM.E53_Place, 'f_place_name', None, None),
+    'g_subregion': (AM.subregion, 'f_subregion_name', 'f_subregion_region', ECRM.P89_falls_within),
+    'b_authority_tag': (AM.taxonomy_tag, 'f_auth_tag_tag', 'f_auth_tag_source', ECRM.P71i_is_listed_in)
+}
+
+
+def _labelled(graph: Graph, slug: str, cls, label: str, appellation=ECRM.E41_Appellation,
+              identified_by=ECRM.P1_is_identified_by, note=ECRM.P3_has_note, uri: URIRef | None = None) -> URIRef:
+    uri = uri if uri is not None else DATA[slug]
+    label_uri = DATA[f"{slug}_{len(graph)}"]
+    graph.add((uri, RDF.type, cls))
+    graph.add((uri, identified_by, label_uri))
+    graph.add((label_uri, RDF.type, appellation))
+    graph.add((label_uri, note, Literal(label, lang='en')))
+    return uri
+
+
+def fixture_graph() -> Graph:
+    """
+    Graph with the vocabulary entities the fixture documents refer to.
+    """
+    graph = Graph()
+    for slug, cls, label in FIXTURE_ENTITIES:
+        _labelled(graph, slug, cls, label)
+
+    # Regions and subregions fall within their broader place
+    nairobi = _labelled(graph, 'nairobi', AM.region, "Nairobi")
+    graph.add((nairobi, ECRM.P89_falls_within, DATA.kenya))
+    westlands = _labelled(graph, 'westlands', AM.subregion, "Westlands")
+    graph.add((westlands, ECRM.P89_falls_within, nairobi))
+
+    # Projects, collections and repositories
+    _labelled(graph, 'project_p1', AM.project, "P1", appellation=ECRM.E42_Identifier,
+              identified_by=ECRM.P48_has_preferred_identifier)
+    collection = _labelled(graph, 'collection_c1', AM.collection, "C1")
+    title = DATA.collection_c1_title
+    graph.add((collection, ECRM.P102_has_title, title))
+    _labelled(graph, 'collection_c1_title', ECRM.E35_Title, "C1")
+    _labelled(graph, 'repository_r01', ECRM.E78_Curated_Holding, "R01", appellation=ECRM.E42_Identifier)
+
+    # Persons (named with am:person_name) and their affiliations
+    jane = _labelled(graph, 'jane', ECRM.E21_Person, "Jane", note=AM.person_name)
+    graph.add((jane, ECRM.P107i_is_current_or_former_member_of, DATA.ubt))
+
+    # Genre terms of an authority, subjects by URL, authorities by URL
+    _labelled(graph, 'novel', AM.taxonomy_tag, "novel")
+    graph.add((DATA.novel, ECRM.P71i_is_listed_in, DATA.marc))
+    _labelled(graph, 'history', AM.subject, "http://example.org/subject/history", appellation=AM.url)
+    _labelled(graph, 'marc', ECRM.E32_Authority_Document, "http://id.loc.gov/marc", appellation=AM.url,
+              identified_by=AM.has_url)
+
+    # A research data item already in WissKI, with its DRE and linked data identifiers
+    _labelled(graph, 'item_0000', AM.information_carrier, "aca-01-0000", appellation=ECRM.E42_Identifier)
+    ld_identifier = DATA.item_0000_ld
+    graph.add((DATA.item_0000, ECRM.P1_is_identified_by, ld_identifier))
+    graph.add((ld_identifier, RDF.type, ECRM.E42_Identifier))
+    graph.add((ld_identifier, ECRM.P129i_is_subject_of, DATA[_LD_SOURCE]))
+    graph.add((ld_identifier, ECRM.P3_has_note, Literal("ld-0000", lang='en')))
+    return graph
+
+
+def fixture_document(index: int = 1) -> dict:
+    """
+    Mongo document of a research data item whose vocabulary values are in the fixture graph.
+
+    Every tenth document also carries values unknown to the store (exception entities).
+    """
+    unknown = index % 10 == 0
+    return {
+        '_id': index,
+        'dre_id': f"aca-01-{index:04d}",
+        'typeOfResource': "Text" if index % 2 else "Dataset",
+        'project': {'id': "P1"},
+        'collection': ["C1"],
+        'identifier': [{'identifier': f"10.1234/{index}", 'identifier_type': "DOI"}],
+        'language': ["eng"] if index % 3 else ["eng", "fre"],
+        'citation': [f"Citation {index}"],
+        'location': {
+            'origin': [{'l1': "Kenya", 'l2': ["Nairobi"], 'l3': "Westlands" if not unknown else f"Ward {index}"}],
+            'current': ["Bayreuth"]
+        },
+        'url': [f"https://example.org/items/{index}"],
+        'accessCondition': {'rights': ["CC BY"]},
+        'targetAudience': ["Public"],
+        'abstract': f"Abstract of item {index}.",
+        'tableOfContents': None,
+        'note': f"Note of item {index}\n\nwith  two lines",
+        'sponsor': ["DFG"],
+        'name': [{'name': {'label': "Jane", 'qualifier': "person"}, 'role': "Author"}],
+        'titleInfo': [{'title': f"Item {index}", 'title_type': "main"},
+                      {'title': f"Alternative {index}", 'title_type': "alt"}],
+        'dateInfo': {'created': {'end': "2020-01-02"}, 'captured': {'end': "2021-03-04"}},
+        'physicalDescription': {'type': "digital", 'method': None, 'desc': ["PDF"], 'note': None, 'tech': ["300 dpi"]},
+        'genre': {'marc': ["novel"]},
+        'subject': [{'uri': "http://example.org/subject/history", 'origLabel': "History",
+                     'authority': None, 'authLabel': None}],
+        'tags': ["foo", "bar"] if not unknown else ["foo", f"tag {index}"],
+        'previewImage': None,
+        'relatedItems': {'rel_succ': ["ld-0000"], 'rel_prec': []}
+    }
+
+
+class LocalSparqlClient:
+    """
+    SPARQL client answering queries from a local rdflib graph, in the formats of `SparqlClient`.
+    """
+
+    def __init__(self, graph: Graph | None = None, fixtures: list[str] | None = None, latency: float = 0.0):
+        self._graph = graph if graph is not None else fixture_graph()
+        for path in fixtures or []:
+            self._graph.parse(path, format='turtle')
+        self._latency = latency
+        # rdflib graphs are not safe for concurrent queries
+        self._lock = threading.Lock()
+        self.query_count = 0
+
+    @property
+    def graph(self) -> Graph:
+        return self._graph
+
+    def query(self, query_string: str, return_format: str = 'json'):
+        if self._latency:
+            time.sleep(self._latency)
+        with self._lock:
+            self.query_count += 1
+            result = self._graph.query(query_string)
+            if return_format == 'json':
+                return json.loads(result.serialize(format='json'))
+            return result.serialize(format='csv')
+
+    def add(self, entity: Entity):
+        """
+        Add a saved research data item or vocabulary entity to the store, as WissKI writes it to GraphDB.
+        """
+        with self._lock:
+            _add_entity(self._graph, entity)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _add_entity(graph: Graph, entity: Entity):
+    current = mappings.current()
+    bundles = {bundle_id: key for key, bundle_id in current.bundles.items()}
+    bundle = bundles.get(entity.bundle_id)
+    uri, slug = URIRef(entity.uri), entity.uri.rsplit('/', 1)[-1]
+
+    if bundle == 'g_research_data_item':
+        # Identifiers (DRE, linked data and others) are notes on E42 identifiers typed by their source
+        graph.add((uri, RDF.type, AM.information_carrier))
+        for value in entity.fields.values():
+            for identifier in value or []:
+                if not isinstance(identifier, Entity):
+                    continue
+                if bundles.get(identifier.bundle_id) != 'g_research_data_item_identifier':
+                    continue
+                name = (identifier.fields.get(current.fields['f_research_data_item_id_name']) or [None])[0]
+                source = (identifier.fields.get(current.fields['f_research_data_item_id_type']) or [None])[0]
+                if name is None:
+                    continue
+                identifier_uri = DATA[f"{slug}_id_{len(graph)}"]
+                graph.add((uri, ECRM.P1_is_identified_by, identifier_uri))
+                graph.add((identifier_uri, RDF.type, ECRM.E42_Identifier))
+                graph.add((identifier_uri, ECRM.P3_has_note, Literal(name, lang='en')))
+                if source is not None:
+                    graph.add((identifier_uri, ECRM.P129i_is_subject_of, URIRef(source)))
+    elif bundle in SAVED_VOCABULARIES:
+        cls, label_field, qualifier_field, qualifier_property = SAVED_VOCABULARIES[bundle]
+        label = (entity.fields.get(current.fields[label_field]) or [None])[0]
+        if label is None:
+            return
+        _labelled(graph, slug, cls, label, uri=uri)
+        if qualifier_field is not None:
+            for qualifier in entity.fields.get(current.fields[qualifier_field]) or []:
+                graph.add((uri, qualifier_property, URIRef(qualifier)))
+
+
+def _payload(value):
+    if isinstance(value, Entity):
+        return {'bundle_id': value.bundle_id, 'uri': value.uri,
+                'fields': {k: _payload(v) for k, v in value.fields.items()}}
+    if isinstance(value, list):
+        return [_payload(v) for v in value]
+    return value
+
+
+class FakeApi:
+    """
+    In-process stand-in for the save/get_entity surface of `wisski.api.Api`.
+
+    Saved entities (and the new sub-entities they hold) get a URI, as WissKI would assign
+    one; every call is recorded with its payload and duration in `calls`. Without
+    `keep_payloads`, only the URIs and durations are kept (e.g. to measure memory use). Saved
+    items and vocabulary entities are added to the `store` client, if given.
+    """
+
+    def __init__(self, save_latency: float = 0.0, get_latency: float = 0.0, keep_payloads: bool = True,
+                 store: LocalSparqlClient | None = None):
+        self.pathbuilders = []
+        self._store = store
+        self._vocabulary_bundles = {bundle_id: key in SAVED_VOCABULARIES
+                                    for key, bundle_id in mappings.current().bundles.items()}
+        self.calls = []
+        self._keep_payloads = keep_payloads
+        self._entities = {}
+        self._save_latency = save_latency
+        self._get_latency = get_latency
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _assign_uris(self, entity: Entity):
+        if entity.uri is None:
+            entity.uri = str(DATA[f"fake_{next(self._ids)}"])
+            if self._store is not None:
+                self._store.add(entity)
+        for values in entity.fields.values():
+            for value in values or []:
+                if isinstance(value, Entity):
+                    self._assign_uris(value)
+
+    def _entity(self, value):
+        # As by the WissKI API, sub-bundle entities are returned as entities and references to
+        # vocabulary entities (created along with the entity holding them) as their URI
+        if isinstance(value, dict) and 'bundle_id' in value:
+            if self._vocabulary_bundles.get(value['bundle_id']):
+                return value['uri']
+            return Entity(api=self, fields={k: self._entity(v) for k, v in value['fields'].items()},
+                          bundle_id=value['bundle_id'], uri=value['uri'])
+        if isinstance(value, list):
+            return [self._entity(v) for v in value]
+        return value
+
+    def save(self, entity: Entity):
+        start = time.perf_counter()
+        if self._save_latency:
+            time.sleep(self._save_latency)
+        with self._lock:
+            self._assign_uris(entity)
+            payload = None
+            if self._keep_payloads:
+                payload = self._entities[entity.uri] = copy.deepcopy(_payload(entity))
+            self.calls.append({'method': 'save', 'uri': entity.uri, 'payload': payload,
+                               'seconds': time.perf_counter() - start})
+        return entity
+
+    def get_entity(self, uri: str) -> Entity:
+        start = time.perf_counter()
+        if self._get_latency:
+            time.sleep(self._get_latency)
+        with self._lock:
+            payload = self._entities.get(uri, {'bundle_id': None, 'uri': uri, 'fields': {}})
+            self.calls.append({'method': 'get_entity', 'uri': uri, 'payload': payload,
+                               'seconds': time.perf_counter() - start})
+            return self._entity(copy.deepcopy({**payload, 'uri': uri}))
+
+    def payloads(self, method: str = 'save') -> list[dict]:
+        return [call['payload'] for call in self.calls if call['method'] == method]
+
+
+if __name__ == "__main__":
+    import sys
+
+    from entity_builder import DocumentEntity
+    from entity_related import UpdateRelation
+    from entity_sync import EntitySync
+    from entity_updater import DocumentUpdate
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    client = LocalSparqlClient()
+    api = FakeApi(store=client)
+    documents = [fixture_document(i) for i in range(1, count + 1)]
+
+    start = time.perf_counter()
+    uploader = DocumentEntity(api, client=client)
+    uploader.prefetch(documents)
+    for doc in documents:
+        uploader.document(doc)
+        uploader.upload()
+    elapsed = time.perf_counter() - start
+    print(f"Uploaded {count} documents in {elapsed:.2f}s ({count / elapsed:.1f}/s), {client.query_count} queries")
+
+    print(DocumentUpdate(api, method=['note', 'country'], mongo_data=[fixture_document(0)], client=client).run())
+    UpdateRelation(api, [fixture_document(0)], client=client).execute()
+    persons = EntitySync(api, 'persons', client=client,
+                         records=[{'name': "Jane", 'affiliation': ["University of Bayreuth"]}, {'name': "Joe"}])
+    print(persons.reconcile()['missing'])
+    print(persons.affiliations_update(dry_run=True))
@@ -1,38 +1,192 @@
-# XML & pandas Library
-from urllib.parse import urlparse
-from datetime import datetime
-import wget
+# Libraries
+import hashlib
 import json
-import glob
 import os
-import time
+import re
+import tempfile
 import xml.etree.ElementTree as eT
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+from mappings import mappings
+
+"""
+Pathbuilder compiler: turns a WissKI pathbuilder export into the bundle and field id
+mappings (bundles.json, fields.json) used by the importers.
+
+Exports are given as a local file or a URL (streamed into pathbuilder/), or default to the
+latest export in pathbuilder/. The export is parsed incrementally and compiled into an
+artifact versioned by the export's timestamp and content hash, recorded in a manifest.
+Compiling an export whose artifact is already current does nothing:
+
+    python path_extractor.py [export file or URL]
+"""
+
+PATHBUILDER_DIR = "pathbuilder"
+DICTS_DIR = "dicts"
+MANIFEST = "pathbuilder_manifest.json"
+
+# Timestamp in the export file names (pb_20241209131252.xml, ..._pb_20240821T122919)
+_TIMESTAMP = re.compile(r"(\d{8})T?(\d{6})")
+
+
+def latest_export(directory: str = PATHBUILDER_DIR) -> Path:
+    """
+    Most recent export in the directory, by the timestamp in its name (else its modification time).
+    """
+    exports = list(Path(directory).glob("*.xml"))
+    if not exports:
+        raise FileNotFoundError(f"No pathbuilder export in {directory}")
+    return max(exports, key=lambda path: (export_timestamp(path), path.name))
+
+
+def export_timestamp(path: Path) -> str:
+    match = _TIMESTAMP.search(path.name)
+    if match:
+        return "".join(match.groups())
+    return datetime.fromtimestamp(path.stat().st_mtime).strftime('%Y%m%d%H%M%S')
+
 
+def download(url: str, directory: str = PATHBUILDER_DIR, timeout: float = 60.0, force: bool = False) -> Path:
+    """
+    Stream an export to the directory; the file only appears once it is complete.
 
-def pathbuilder_save(xml_file_name=max(glob.glob("pathbuilder/*"), key=os.path.getctime)):
+    An export already downloaded under the same timestamp is reused unless `force` is set.
+    """
+    match = _TIMESTAMP.search(urlparse(url).path)
+    timestamp = "".join(match.groups()) if match else datetime.now().strftime('%Y%m%d%H%M%S')
+    target = Path(directory) / f"pb_{timestamp}.xml"
+    if target.is_file() and not force:
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
 
-    if os.path.isfile(xml_file_name):
-        tree = eT.parse(xml_file_name)
-    elif urlparse(xml_file_name).netloc:
-        wget.download(xml_file_name, out=f"pathbuilder/pb_{datetime.now().strftime('%Y%m%d%H%M%S')}.xml")
-        time.sleep(20)
-        latest = max(glob.glob("pathbuilder/*"), key=os.path.getctime)
-        tree = eT.parse(latest)
+    with requests.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        expected = response.headers.get('Content-Length')
+        received = 0
+        with tempfile.NamedTemporaryFile('wb', dir=target.parent, suffix=".part", delete=False) as part:
+            try:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    part.write(chunk)
+                    received += len(chunk)
+            except BaseException:
+                os.unlink(part.name)
+                raise
+    if expected is not None and received != int(expected) and not response.headers.get('Content-Encoding'):
+        os.unlink(part.name)
+        raise IOError(f"Incomplete download of {url}: {received} of {expected} bytes")
+    os.replace(part.name, target)
+    return target
 
-    root = tree.getroot()
-    bundles = {}
-    fields = {}
-    for path in root.findall('path'):
-        if path.find('is_group').text == '1':
-            bundles[path.find('id').text] = path.find('bundle').text
-        elif path.find('is_group').text == '0':
-            fields[path.find('id').text] = path.find('field').text
 
-    # Generating json files
-    with open('dicts/bundles.json', 'w') as bfile:
-        json.dump(bundles, bfile)
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    with open('dicts/fields.json', 'w') as ffile:
-        json.dump(fields, ffile)
 
+def parse_export(path: Path) -> tuple[dict, dict]:
+    """
+    Bundle and field ids of the groups and fields of an export, parsed path by path.
+    """
+    bundles, fields = {}, {}
+    context = eT.iterparse(path, events=('start', 'end'))
+    _, root = next(context)
+    for event, element in context:
+        if event != 'end' or element.tag != 'path':
+            continue
+        is_group = element.findtext('is_group')
+        if is_group == '1':
+            bundles[element.findtext('id')] = element.findtext('bundle')
+        elif is_group == '0':
+            fields[element.findtext('id')] = element.findtext('field')
+        # Finished paths are dropped, so memory stays flat for large exports
+        element.clear()
+        root.clear()
+    return bundles, fields
+
+
+def _write_json(path: Path, data: dict):
+    # Written next to the target and renamed, so readers never see a partial file
+    with tempfile.NamedTemporaryFile('w', dir=path.parent, suffix=".tmp", delete=False) as file_obj:
+        json.dump(data, file_obj, indent=2, sort_keys=True)
+    os.chmod(file_obj.name, 0o644)
+    os.replace(file_obj.name, path)
+
+
+def read_manifest(dicts_dir: str = DICTS_DIR) -> dict | None:
+    path = Path(dicts_dir) / MANIFEST
+    if not path.is_file():
+        return None
+    with open(path) as file_obj:
+        return json.load(file_obj)
+
+
+def compile_pathbuilder(source: str | None = None, dicts_dir: str = DICTS_DIR, force: bool = False) -> dict:
+    """
+    Compile an export (file, URL or the latest in pathbuilder/) into bundles.json and fields.json.
+
+    The compiled mappings are kept as dicts/compiled/pb_<timestamp>_<hash>.json and the
+    current version is recorded in the manifest; the mapping registry is reloaded. Returns
+    the manifest, with `changed` set when the mappings were (re)written. URL exports already
+    in pathbuilder/ are not downloaded again unless `force` is set.
+    """
+    if source is None:
+        export = latest_export()
+    elif urlparse(source).netloc:
+        export = download(source, force=force)
+    else:
+        export = Path(source)
+
+    digest = file_hash(export)
+    version = f"{export_timestamp(export)}_{digest[:12]}"
+    dicts = Path(dicts_dir)
+    manifest = read_manifest(dicts_dir)
+    if (not force and manifest is not None and manifest.get('sha256') == digest
+            and (dicts / manifest['artifact']).is_file()
+            and (dicts / "bundles.json").is_file() and (dicts / "fields.json").is_file()):
+        return {**manifest, 'changed': False}
+
+    bundles, fields = parse_export(export)
+    artifact = Path("compiled") / f"pb_{version}.json"
+    (dicts / artifact).parent.mkdir(parents=True, exist_ok=True)
+    _write_json(dicts / artifact, {'bundles': bundles, 'fields': fields})
+    _write_json(dicts / "bundles.json", bundles)
+    _write_json(dicts / "fields.json", fields)
+
+    manifest = {
+        'version': version,
+        'source': str(export),
+        'sha256': digest,
+        'artifact': artifact.as_posix(),
+        'bundles': len(bundles),
+        'fields': len(fields),
+        'compiled': datetime.now().isoformat(timespec='seconds')
+    }
+    _write_json(dicts / MANIFEST, manifest)
+
+    # Entity classes created from now on use the new mappings
+    if dicts.resolve() == mappings.dicts_dir.resolve():
+        mappings.reload()
+    return {**manifest, 'changed': True}
+
+
+def pathbuilder_save(xml_file_name: str | None = None):
+    """
+    Compile the given export (default: the latest in pathbuilder/), see `compile_pathbuilder`.
+    """
+    compile_pathbuilder(xml_file_name)
     return "Success!"
+
+
+if __name__ == "__main__":
+    import sys
+
+    result = compile_pathbuilder(sys.argv[1] if len(sys.argv) > 1 else None)
+    print(f"{'Compiled' if result['changed'] else 'Up to date'}: {result['version']} "
+          f"({result['bundles']} bundles, {result['fields']} fields)")
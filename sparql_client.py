@@ -0,0 +1,116 @@
+# Libraries
+import functools
+import threading
+
+"""
+Long-lived SPARQL client for the GraphDB endpoint.
+
+The configuration is read once, and all queries of a thread share one HTTP session, so that
+connections are kept alive and reused instead of being opened (and authenticated) per lookup.
+`requests.Session` is not documented as thread-safe, so each thread gets a session of its own.
+"""
+
+
+class SparqlClient:
+    """
+    Pooled SPARQL client returning the same results as `SPARQLWrapper.queryAndConvert`.
+
+    The client can be shared between threads; each thread queries through its own session.
+    """
+
+    # Accept headers for the supported return formats
+    _accept = {
+        'json': 'application/sparql-results+json',
+        'csv': 'text/csv'
+    }
+
+    def __init__(
+        self,
+        endpoint: str | None = None,
+        auth: tuple[str, str] | None = None,
+        pool_size: int = 10,
+        timeout: float = 120,
+        retries: int = 3,
+    ):
+        if endpoint is None or auth is None:
+            # Imported here, functions itself relies on this module
+            from functions import load_config
+            config = load_config()
+            endpoint = endpoint or config['sparql_endpoint']
+            auth = auth or (config['sparql_username'], config['sparql_password'])
+
+        self._endpoint = endpoint
+        self._auth = auth
+        self._pool_size = pool_size
+        self._retries = retries
+        self._timeout = timeout
+
+        # One session per thread, all of them closed by `close`
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    def _new_session(self):
+        # Imported here, requests takes longer to import than the importers themselves
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        # Keep-alive connection pool with retries on transient server errors
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self._pool_size,
+            max_retries=Retry(total=self._retries, backoff_factor=0.5, status_forcelist=(502, 503, 504),
+                              allowed_methods=None)
+        )
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.auth = self._auth
+        session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        return session
+
+    @property
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._new_session()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def query(self, query_string: str, return_format: str = 'json'):
+        """
+        Run a query; returns the parsed JSON results, or the raw CSV bytes.
+        """
+        response = self._session.post(
+            self._endpoint,
+            data={'query': query_string},
+            headers={'Accept': self._accept[return_format]},
+            timeout=self._timeout
+        )
+        response.raise_for_status()
+        if return_format == 'json':
+            return response.json()
+        return response.content
+
+    def close(self):
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+        for session in sessions:
+            session.close()
+        self._local = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@functools.cache
+def default_client() -> SparqlClient:
+    """
+    Client shared by all lookups that are not given a client of their own.
+    """
+    return SparqlClient()
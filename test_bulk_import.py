@@ -0,0 +1,97 @@
+# Libraries
+from entity_builder import DocumentEntity
+from entity_updater import DocumentUpdate
+from bulk_import import BulkImport
+from offline_harness import FakeApi, LocalSparqlClient, fixture_document
+from uri_cache import UriCache
+
+"""
+Incremental imports with `BulkImport`, run against the offline harness.
+"""
+
+
+class RecordingUpdate(DocumentUpdate):
+    """
+    Updater recording the documents passed to it instead of editing WissKI entities.
+    """
+
+    def __init__(self, api, method, client):
+        super().__init__(api, method=method, mongo_data=[], client=client)
+        self.updated = []
+
+    def run(self, value_append: bool = False, new_value=None, dry_run=False, documents: list[dict] | None = None):
+        self.updated.extend(doc['dre_id'] for doc in documents)
+        return {'changed': [(doc['dre_id'], method) for doc in documents for method in self._method],
+                'unchanged': [], 'failed': []}
+
+
+def incremental_run(journal, method: list[str], documents: list[dict]) -> RecordingUpdate:
+    client, api = LocalSparqlClient(), FakeApi()
+    updater = RecordingUpdate(api, method, client)
+    uploader = DocumentEntity(api, cache=UriCache(), client=client)
+    with BulkImport(uploader, journal=str(journal), incremental=True, updater=updater) as importer:
+        importer.run(documents)
+    return updater
+
+
+def test_change_outside_updater_fields_is_not_journaled_as_synced(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    document = fixture_document(1)
+    incremental_run(journal, ['subject'], [document])
+
+    # Subject and tags change, only the subject is brought up to date
+    changed = {**document, 'subject': [{**document['subject'][0], 'origLabel': "Geography"}], 'tags': ["foo"]}
+    assert incremental_run(journal, ['subject'], [changed]).updated == [document['dre_id']]
+    assert incremental_run(journal, ['subject'], [changed]).updated == []
+
+    # The tags change is still pending for an updater writing the tags
+    assert incremental_run(journal, ['subject', 'tags'], [changed]).updated == [document['dre_id']]
+    assert incremental_run(journal, ['subject', 'tags'], [changed]).updated == []
+
+
+def test_full_import_is_the_baseline_of_incremental_runs(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    client, api = LocalSparqlClient(), FakeApi()
+    uploader = DocumentEntity(api, cache=UriCache(), client=client)
+    with BulkImport(uploader, journal=str(journal)) as importer:
+        importer.run([fixture_document(1), fixture_document(2)])
+    assert incremental_run(journal, ['subject'], [fixture_document(1), fixture_document(2)]).updated == []
+
+
+def test_items_found_in_wisski_are_updated_once(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    client = LocalSparqlClient()
+    api = FakeApi(store=client)
+    document = fixture_document(1)
+    # Saved by other means, so that the importer only finds it
+    uploader = DocumentEntity(api, cache=UriCache(), client=client)
+    uploader.document(document)
+    uploader.upload()
+
+    updater = RecordingUpdate(api, ['subject'], client)
+    for updated in ([], [document['dre_id']], []):
+        updater.updated = []
+        with BulkImport(uploader, journal=str(journal), incremental=True, updater=updater) as importer:
+            importer.run([document])
+        assert updater.updated == updated
+
+
+class RejectingSparqlClient(LocalSparqlClient):
+    """
+    Client failing every query that holds a rejected value, as GraphDB does for invalid queries.
+    """
+
+    def query(self, query_string: str, return_format: str = 'json'):
+        if "rejected tag" in query_string:
+            raise ValueError("Invalid query")
+        return super().query(query_string, return_format)
+
+
+def test_value_failing_the_batched_lookups_only_fails_its_document(tmp_path):
+    documents = [fixture_document(i) for i in range(1, 6)]
+    documents[2] = {**documents[2], 'tags': ["foo", "rejected tag"]}
+    uploader = DocumentEntity(FakeApi(), cache=UriCache(), client=RejectingSparqlClient())
+    with BulkImport(uploader, journal=str(tmp_path / "journal.jsonl")) as importer:
+        summary = importer.run(documents)
+    assert summary['saved'] == 4
+    assert [dre_id for dre_id, _ in summary['failed']] == [documents[2]['dre_id']]
@@ -0,0 +1,29 @@
+# Libraries
+import pytest
+
+from entity_builder import DocumentEntity
+from entity_updater import DocumentUpdate
+from field_registry import FIELDS
+from offline_harness import FakeApi, LocalSparqlClient, fixture_document
+from uri_cache import UriCache
+
+"""
+Field updates with `DocumentUpdate`, run against the offline harness.
+"""
+
+
+# Document 10 also creates exception entities (unknown tag and subregion)
+@pytest.mark.parametrize('index', [1, 10])
+def test_update_with_identical_document_changes_nothing(index):
+    client = LocalSparqlClient()
+    api = FakeApi(store=client)
+    document = fixture_document(index)
+    uploader = DocumentEntity(api, cache=UriCache(), client=client)
+    uploader.document(document)
+    uploader.upload()
+    saves = len(api.payloads())
+
+    updater = DocumentUpdate(api, method=list(FIELDS), mongo_data=[document], cache=UriCache(), client=client)
+    summary = updater.run()
+    assert summary['changed'] == [] and summary['failed'] == []
+    assert len(api.payloads()) == saves
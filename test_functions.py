@@ -0,0 +1,43 @@
+# Libraries
+from rdflib.plugins.sparql import prepareQuery
+
+from functions import entity_uri, entity_uri_batch, values_query
+from mappings import mappings
+from offline_harness import LocalSparqlClient
+from uri_cache import UriCache
+
+"""
+Entity URI lookups in `functions`, run against the offline harness and the rdflib parser.
+"""
+
+# Values with characters a "..." literal cannot hold unescaped
+AWKWARD_VALUES = ["line one\nline two", "carriage\rreturn", "tab\tbed", 'quote " and \\ backslash', "foo"]
+
+
+def test_values_query_parses_with_line_breaks():
+    batch_query, _ = values_query(mappings.current().queries['tags'], AWKWARD_VALUES)
+    prepareQuery(batch_query)
+
+
+def test_batched_lookup_resolves_alongside_line_breaks():
+    resolved = entity_uri_batch(AWKWARD_VALUES, mappings.current().queries['tags'], cache={},
+                                client=LocalSparqlClient())
+    assert list(resolved) == ["foo"]
+
+
+class ExpiringUriCache(UriCache):
+    """
+    Cache whose entries expire between a membership test and the read.
+    """
+
+    def __contains__(self, key):
+        return True
+
+    def _get(self, key: str):
+        raise KeyError(key)
+
+
+def test_entry_expiring_during_the_lookup_is_a_miss():
+    uri = entity_uri("Kenya", mappings.current().queries['country'], cache=ExpiringUriCache(),
+                     client=LocalSparqlClient())
+    assert uri == "http://www.wisski.uni-bayreuth.de/data/kenya"
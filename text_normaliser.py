@@ -0,0 +1,71 @@
+# Libraries
+import re
+from typing import Iterable
+
+"""
+Normalisation of free-text fields (notes, abstracts, tables of contents).
+
+Line breaks of any kind become "\n", other whitespace is collapsed to single spaces,
+characters outside the kept set are dropped, lines are stripped and empty lines removed.
+The patterns are compiled once: each string takes one regular expression pass, and
+whitespace is collapsed by str.split and str.join. `batch` normalises many strings in one
+pass over their concatenation, and `prepare` keeps the results of a batch of documents for
+the builders to pick up.
+"""
+
+# Characters str.splitlines() breaks on
+_BREAKS = r"\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029"
+
+# Separator of the strings of a batch, never kept from the input
+_SEPARATOR = "\x00"
+
+# Characters dropped: all but printable Latin-1, or control and invisible formatting
+# characters (zero width, bidi controls, soft hyphen, BOM); line breaks and whitespace are kept
+_LATIN1 = re.compile(f"[^\\x00{_BREAKS}\\x20-\\x7E\\xA0-\\xFF]+")
+_CONTROL = re.compile(r"[\x01-\x08\x0e-\x1b\x7f-\x84\x86-\x9f\xad\u200b-\u200f\u202a-\u202e\u2060-\u2064\ufeff]+")
+
+
+class TextNormaliser:
+    """
+    Normaliser of free text, keeping printable Unicode or (with `latin1`) only printable Latin-1.
+    """
+
+    def __init__(self, latin1: bool = False):
+        self._drop = _LATIN1 if latin1 else _CONTROL
+        self._prepared = {}
+
+    def _pass(self, text: str) -> str:
+        # Whitespace is collapsed per line by str.split, empty lines are left out
+        lines = map(" ".join, map(str.split, self._drop.sub("", text).splitlines()))
+        return "\n".join([line for line in lines if line])
+
+    def __call__(self, text: str) -> str:
+        prepared = self._prepared.get(text)
+        if prepared is not None:
+            return prepared
+        if _SEPARATOR in text:
+            text = text.replace(_SEPARATOR, "")
+        return self._pass(text)
+
+    def batch(self, texts: Iterable[str]) -> list[str]:
+        """
+        Normalise many strings at once.
+        """
+        texts = [text.replace(_SEPARATOR, "") if _SEPARATOR in text else text for text in texts]
+        if not texts:
+            return []
+        return [text.strip(" \n") for text in self._pass(_SEPARATOR.join(texts)).split(_SEPARATOR)]
+
+    def prepare(self, texts: Iterable[str]):
+        """
+        Normalise a batch of strings ahead; later calls with them return the prepared result.
+
+        Only the last prepared batch is kept.
+        """
+        texts = list(dict.fromkeys(text for text in texts if isinstance(text, str)))
+        self._prepared = dict(zip(texts, self.batch(texts)))
+
+
+# Normalisers of the free-text fields (notes keep their Latin-1 character set)
+note_text = TextNormaliser(latin1=True)
+free_text = TextNormaliser()
@@ -0,0 +1,179 @@
+# Libraries
+import contextvars
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+"""
+Optional tracing of imports: a span per document (by DRE identifier), child spans per
+builder method and spans for each SPARQL query and WissKI call below them. Bulk imports add
+a span per batch, holding the prefetched lookups of its documents and their document spans.
+
+Tracing is off until enabled. Spans are exported with OpenTelemetry to an OTLP collector
+when an endpoint is given (or set in OTEL_EXPORTER_OTLP_ENDPOINT) and the opentelemetry-sdk
+and opentelemetry-exporter-otlp packages are installed; otherwise they are written to a
+local JSON lines file, with OpenTelemetry-style trace and span ids:
+
+    tracer.enable("cache/trace.jsonl")
+    ...
+    python tracing.py cache/trace.jsonl     # slowest documents and query templates
+"""
+
+# Span of the running block; copied into worker threads and asyncio tasks
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class _FileExporter:
+    """
+    Writes finished spans as JSON lines.
+    """
+
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def export(self, span: dict):
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _otel_tracer(endpoint: str):
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({'service.name': "wisski_import"}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint)))
+    return provider, provider.get_tracer("wisski_import")
+
+
+class Tracer:
+    """
+    Process-wide tracer; `span` is a no-op while tracing is disabled.
+    """
+
+    def __init__(self):
+        self._exporter = None
+        self._provider = None
+        self._otel = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._exporter is not None or self._otel is not None
+
+    def enable(self, path: str = "cache/trace.jsonl", endpoint: str | None = None):
+        """
+        Export spans to the OTLP collector at `endpoint`, or to the JSON lines file at `path`.
+        """
+        self.disable()
+        endpoint = endpoint or os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT')
+        if endpoint:
+            try:
+                self._provider, self._otel = _otel_tracer(endpoint)
+                return
+            except ImportError:
+                print("OpenTelemetry is not installed, writing spans to " + path, file=sys.stderr)
+        self._exporter = _FileExporter(path)
+
+    def disable(self):
+        if self._exporter is not None:
+            self._exporter.close()
+        if self._provider is not None:
+            self._provider.shutdown()
+        self._exporter = self._provider = self._otel = None
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if self._otel is not None:
+            with self._otel.start_as_current_span(name, attributes=attributes):
+                yield
+            return
+        if self._exporter is None:
+            yield
+            return
+
+        parent = _current_span.get()
+        span = {
+            'trace_id': parent['trace_id'] if parent else secrets.token_hex(16),
+            'span_id': secrets.token_hex(8),
+            'parent_id': parent['span_id'] if parent else None,
+            'name': name,
+            'attributes': attributes,
+            'start': time.time(),
+            'status': 'ok'
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            span['status'] = 'error'
+            span['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span['duration'] = time.perf_counter() - start
+            _current_span.reset(token)
+            self._exporter.export(span)
+
+
+# Tracer shared by all instrumented code
+tracer = Tracer()
+
+
+def slowest(path: str = "cache/trace.jsonl", count: int = 10) -> dict:
+    """
+    Slowest documents of a JSON lines trace, with their slowest spans, and the query
+    templates with the most time spent in them.
+    """
+    spans = []
+    with open(path) as file_obj:
+        for line in file_obj:
+            spans.append(json.loads(line))
+
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+
+    def descendants(span):
+        for child in children[span['span_id']]:
+            yield child
+            yield from descendants(child)
+
+    documents = sorted((s for s in spans if s['name'] == 'document'), key=lambda s: s['duration'], reverse=True)
+    queries = defaultdict(lambda: [0, 0.0])
+    for span in spans:
+        if span['name'] == 'sparql_query':
+            total = queries[span['attributes'].get('query')]
+            total[0] += 1
+            total[1] += span['duration']
+
+    return {
+        'documents': [
+            {'dre_id': document['attributes'].get('dre_id'), 'seconds': document['duration'],
+             'slowest': [(s['name'], s['attributes'], s['duration'])
+                         for s in sorted(descendants(document), key=lambda s: s['duration'], reverse=True)[:5]]}
+            for document in documents[:count]
+        ],
+        'queries': [
+            {'query': query, 'count': n, 'seconds': seconds}
+            for query, (n, seconds) in sorted(queries.items(), key=lambda item: item[1][1], reverse=True)[:count]
+        ]
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(slowest(*sys.argv[1:2]), indent=2, default=str))
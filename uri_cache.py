@@ -0,0 +1,175 @@
+# Libraries
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping
+from pathlib import Path
+
+"""
+Cache backends for the entity URIs resolved by `functions.entity_uri`.
+
+Keys are built by `functions.cache_key` from a fingerprint of the query template and the
+escaped search value, so that they are the same in every process and across runs. Both
+backends are mutable mappings and can be injected wherever a plain dictionary was used.
+"""
+
+
+def query_fingerprint(query_string: str) -> str:
+    """
+    Stable fingerprint of a query template, independent of its whitespace.
+    """
+    canonical = " ".join(query_string.split())
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+
+class UriCache(MutableMapping):
+    """
+    In-memory entity URI cache with an optional time-to-live (in seconds).
+
+    Misses are stored as `None` and expire after `miss_ttl`, so that an unknown value is
+    looked up once per period instead of once per document. An attached vocabulary index
+    (see `vocabulary.VocabularyIndex`) is consulted before the stored entries.
+    """
+
+    def __init__(self, ttl: float | None = None, miss_ttl: float | None = 600, index=None):
+        self._ttl = ttl
+        self._miss_ttl = miss_ttl
+        self._entries = {}
+        self.index = index
+        # Builder methods may share the cache between threads (see DocumentEntity.staging_async)
+        self._lock = threading.Lock()
+
+    def _default_ttl(self, value) -> float | None:
+        return self._miss_ttl if value is None else self._ttl
+
+    def _expires(self, ttl: float | None) -> float | None:
+        return time.time() + ttl if ttl is not None else None
+
+    def store(self, key: str, value, ttl: float | None = None):
+        """
+        Store a value, with a time-to-live overriding the default of the cache.
+        """
+        with self._lock:
+            self._entries[key] = (value, self._expires(ttl if ttl is not None else self._default_ttl(value)))
+
+    def invalidate(self, query_string: str | None = None):
+        """
+        Drop all entries of one query template, or the whole cache.
+        """
+        with self._lock:
+            if query_string is None:
+                self._entries.clear()
+            else:
+                prefix = f"{query_fingerprint(query_string)}:"
+                for key in [k for k in self._entries if k.startswith(prefix)]:
+                    del self._entries[key]
+
+    def __getitem__(self, key: str):
+        if self.index is not None:
+            uri = self.index.get(key)
+            if uri is not None:
+                return uri
+        try:
+            return self._get(key)
+        except KeyError:
+            # Values missing from a loaded vocabulary are known misses
+            if self.index is not None and self.index.covers(key):
+                return None
+            raise
+
+    def _get(self, key: str):
+        with self._lock:
+            value, expires = self._entries[key]
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                raise KeyError(key)
+            return value
+
+    def __setitem__(self, key: str, value):
+        self.store(key, value)
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            del self._entries[key]
+
+    def __iter__(self):
+        now = time.time()
+        with self._lock:
+            return iter([k for k, (_, expires) in self._entries.items() if expires is None or expires >= now])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+class SQLiteUriCache(UriCache):
+    """
+    Persistent entity URI cache stored in a local SQLite file.
+
+    The cache can be shared between runs and between worker processes working on the same file.
+    """
+
+    def __init__(self, path: str = "cache/uri_cache.sqlite", ttl: float | None = None,
+                 miss_ttl: float | None = 600, index=None):
+        super().__init__(ttl=ttl, miss_ttl=miss_ttl, index=index)
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS uri_cache "
+            "(key TEXT PRIMARY KEY, query TEXT NOT NULL, value TEXT, expires REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS uri_cache_query ON uri_cache (query)")
+
+    def store(self, key: str, value, ttl: float | None = None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO uri_cache (key, query, value, expires) VALUES (?, ?, ?, ?)",
+                (key, key.split(":", 1)[0], value, self._expires(ttl if ttl is not None else self._default_ttl(value)))
+            )
+
+    def invalidate(self, query_string: str | None = None):
+        with self._lock:
+            if query_string is None:
+                self._connection.execute("DELETE FROM uri_cache")
+            else:
+                self._connection.execute("DELETE FROM uri_cache WHERE query = ?", (query_fingerprint(query_string),))
+
+    def purge(self):
+        """
+        Remove expired entries from the cache file.
+        """
+        with self._lock:
+            self._connection.execute("DELETE FROM uri_cache WHERE expires < ?", (time.time(),))
+
+    def _get(self, key: str):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires FROM uri_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            raise KeyError(key)
+        return row[0]
+
+    def __delitem__(self, key: str):
+        with self._lock:
+            cursor = self._connection.execute("DELETE FROM uri_cache WHERE key = ?", (key,))
+        if not cursor.rowcount:
+            raise KeyError(key)
+
+    def __iter__(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT key FROM uri_cache WHERE expires IS NULL OR expires >= ?", (time.time(),)
+            ).fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM uri_cache WHERE expires IS NULL OR expires >= ?", (time.time(),)
+            ).fetchone()[0]
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,123 @@
+# Libraries
+import json
+import time
+from pathlib import Path
+
+from functions import cache_key, entity_list_stream, json_file
+from mappings import mappings
+from sparql_client import SparqlClient, default_client
+from uri_cache import query_fingerprint
+
+"""
+In-memory label -> URI index of the small controlled vocabularies.
+
+Each vocabulary is downloaded with a single list query (see the `*list` queries in
+sparql_queries.json) and indexed under the cache keys of its lookup query. Attached to a
+`UriCache`, the index answers `entity_uri` lookups for these vocabularies without a request;
+values missing from a loaded vocabulary are known misses as well, except for the
+vocabularies the importers add to (languages and audiences, see the exception functions),
+whose missing values are looked up in GraphDB. Snapshots on disk are
+downloaded again once they are older than `max_age` (default: a day), so that values added
+to a vocabulary are not treated as misses forever.
+
+Refresh the snapshot on disk with:
+
+    python vocabulary.py
+"""
+
+
+class VocabularyIndex:
+
+    # Lookup query -> list query
+    _vocabularies = {
+        "country": "countrylist",
+        "language": "languagelist",
+        "role": "rolelist",
+        "license": "licenselist",
+        "audience": "audiencelist",
+        "typeofresource": "typeofresourcelist",
+        "authority": "authoritylist",
+        "identifier": "identifierlist",
+        "repository": "repositorylist"
+    }
+
+    # Vocabularies whose missing values are created by the importers (see FieldFunctions)
+    _extended = ("language", "audience")
+
+    def __init__(self, client: SparqlClient | None = None):
+        self._client = client
+        self._query = mappings.current().queries
+        self._entries = {}
+        self._complete = set()
+        self.saved = None
+        # A value missing from the snapshot may have been created since
+        self._open = {query_fingerprint(self._query.get(query_key)) for query_key in self._extended}
+
+    def refresh(self, vocabularies: list[str] | None = None):
+        """
+        (Re-)download the given vocabularies (default: all) into the index.
+        """
+        client = self._client if self._client is not None else default_client()
+        for query_key in vocabularies or self._vocabularies:
+            query_string = self._query.get(query_key)
+            fingerprint = query_fingerprint(query_string)
+
+            # Drop the previous state of the vocabulary
+            self._entries = {k: v for k, v in self._entries.items() if not k.startswith(f"{fingerprint}:")}
+            self._complete.discard(fingerprint)
+
+            for uri, label in entity_list_stream(self._query.get(self._vocabularies[query_key]), client=client):
+                # The first URI of a label wins
+                self._entries.setdefault(cache_key(label, query_string), uri)
+            self._complete.add(fingerprint)
+        return self
+
+    def get(self, key: str) -> str | None:
+        """
+        URI indexed under a cache key.
+        """
+        return self._entries.get(key)
+
+    def covers(self, key: str) -> bool:
+        """
+        Whether the cache key belongs to a loaded vocabulary with a fixed set of values, so
+        that a value missing from it is a known miss.
+        """
+        fingerprint = key.split(":", 1)[0]
+        return fingerprint in self._complete and fingerprint not in self._open
+
+    def save(self, path: str = "cache/vocabulary.json"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.saved = time.time()
+        with open(path, 'w') as file_obj:
+            json.dump({'entries': self._entries, 'complete': sorted(self._complete), 'saved': self.saved}, file_obj)
+
+    @classmethod
+    def from_file(cls, path: str = "cache/vocabulary.json", client: SparqlClient | None = None,
+                  max_age: float | None = 86400):
+        """
+        Load a snapshot written by `save`; the vocabularies are downloaded (and saved to the
+        file) when it is missing or older than `max_age` seconds.
+        """
+        index = cls(client=client)
+        if Path(path).is_file():
+            snapshot = json_file(path)
+            # Snapshots written before the save time was recorded count as expired
+            saved = snapshot.get('saved')
+            if max_age is None or (saved is not None and time.time() - saved <= max_age):
+                index._entries = snapshot['entries']
+                index._complete = set(snapshot['complete'])
+                index.saved = saved
+                return index
+        index.refresh()
+        index.save(path)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+
+if __name__ == "__main__":
+    vocabulary = VocabularyIndex().refresh()
+    vocabulary.save()
+    print(f"{len(vocabulary)} vocabulary entries saved.")